@@ -1,63 +1,462 @@
 import sqlite3
 import json
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 import os
 import logging
+import threading
+import queue
+import atexit
+from collections import OrderedDict
+import time
+from contextlib import closing, contextmanager
 
 logger = logging.getLogger(__name__)
 
+# Per-connection tuning applied every time a connection is opened
+CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA busy_timeout=30000',
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA mmap_size=268435456',  # read through a 256MB memory map instead of pread(); no-op for :memory:
+)
+
+# Page size for newly created database files; SQLite ignores it for existing ones
+PAGE_SIZE = 8192
+
+# Timestamps are stored as INTEGER milliseconds since the Unix epoch
+EPOCH_MS_DEFAULT = "(CAST(strftime('%s', 'now') AS INTEGER) * 1000)"
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+# Bumped whenever init_database needs to migrate existing data
+SCHEMA_VERSION = 2
+
+# Size of the driver's prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+# Hot-path SQL, kept as constants so every call hits the statement cache
+SQL_UPSERT_CHAT = '''
+    INSERT INTO chats (id, title, created_at, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at
+'''
+
+SQL_CREATE_CHAT = '''
+    INSERT INTO chats (id, title, created_at, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at
+'''
+
+SQL_INSERT_MESSAGE = '''
+    INSERT INTO messages (chat_id, type, content, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+
+SQL_GET_HISTORY = '''
+    SELECT type, content, timestamp FROM messages
+    WHERE chat_id = ? ORDER BY timestamp ASC, id ASC
+'''
+
+SQL_GET_HISTORY_LIMIT = SQL_GET_HISTORY + ' LIMIT ?'
+
+SQL_GET_ALL_CHATS = '''
+    SELECT c.id, c.title, c.created_at, c.updated_at,
+           m.content as last_message, m.timestamp as last_message_time
+    FROM chats c
+    LEFT JOIN messages m ON m.id = (
+        SELECT id FROM messages
+        WHERE chat_id = c.id
+        ORDER BY timestamp DESC, id DESC
+        LIMIT 1
+    )
+    ORDER BY c.updated_at DESC
+'''
+
+SQL_GET_CHAT_INFO = 'SELECT id, title, created_at, updated_at FROM chats WHERE id = ?'
+
+SQL_GET_USER_MEMORY = 'SELECT value FROM user_memory WHERE key = ?'
+
+SQL_SET_USER_MEMORY = '''
+    INSERT OR REPLACE INTO user_memory (key, value, created_at, updated_at)
+    VALUES (?, ?, ?, ?)
+'''
+
+SQL_GET_ALL_USER_MEMORY = 'SELECT key, value FROM user_memory ORDER BY key'
+
+# Full-text index over messages.content, kept in sync by triggers
+FTS_SCHEMA = (
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+    USING fts5(content, content='messages', content_rowid='id')
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    ''',
+)
+
+# Row counts maintained by triggers so totals don't need a COUNT(*) scan
+COUNTER_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chats_count_ai AFTER INSERT ON chats BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'chats';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS chats_count_ad AFTER DELETE ON chats BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'chats';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS messages_count_ai AFTER INSERT ON messages BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'messages';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS messages_count_ad AFTER DELETE ON messages BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'messages';
+    END
+    ''',
+)
+
+SQL_GET_COUNTER = 'SELECT value FROM counters WHERE name = ?'
+
+SQL_SEARCH_MESSAGES_FTS = '''
+    SELECT m.chat_id, m.type, m.content, m.timestamp, c.title
+    FROM messages_fts f
+    JOIN messages m ON m.id = f.rowid
+    JOIN chats c ON m.chat_id = c.id
+    WHERE messages_fts MATCH ?
+    ORDER BY m.timestamp DESC
+    LIMIT ?
+'''
+
+SQL_SEARCH_MESSAGES_LIKE = '''
+    SELECT m.chat_id, m.type, m.content, m.timestamp, c.title
+    FROM messages m
+    JOIN chats c ON m.chat_id = c.id
+    WHERE m.content LIKE ?
+    ORDER BY m.timestamp DESC
+    LIMIT ?
+'''
+
+# Pages copied per step by the online backup API
+BACKUP_PAGES_PER_STEP = 256
+
+# Entries kept by the in-process user memory / chat info caches
+LOOKUP_CACHE_SIZE = 512
+
+# Seconds the get_all_user_memory / get_all_chats results are reused for
+SNAPSHOT_CACHE_TTL = 5.0
+
+# Background writer: commit up to this many queued messages at once,
+# waiting at most this many seconds for a batch to fill
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_WAIT = 0.01
+# A batch that fails to commit is retried whole this many times in all, then
+# row by row so one bad row or a long lock wait drops as little as possible
+WRITE_BATCH_ATTEMPTS = 2
+
+# Allowed values of messages.type (mirrors the CHECK constraint)
+MESSAGE_TYPES = ('user', 'ai')
+
+# Rows fetched per round trip when streaming a chat history
+HISTORY_BATCH_SIZE = 100
+
+def _now_ms() -> int:
+    """Current time as epoch milliseconds"""
+    return int(time.time() * 1000)
+
+def _to_epoch_ms(value) -> Optional[int]:
+    """Normalise an epoch-ms int or an ISO timestamp string to epoch milliseconds"""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(datetime.fromisoformat(str(value)).timestamp() * 1000)
+    except ValueError:
+        return None
+
+def _fts_query(search_term: str) -> str:
+    """Turn free text into an FTS5 query: each word quoted, the last one as a prefix"""
+    words = ['"' + word.replace('"', '""') + '"' for word in search_term.split()]
+    return ' '.join(words) + '*'
+
+def _history_row(cursor, row) -> Dict:
+    """Row factory for SQL_GET_HISTORY"""
+    return {'role': row[0], 'content': row[1], 'timestamp': row[2]}  # role is 'user' or 'ai'
+
+def _message_with_chat_row(cursor, row) -> Dict:
+    """Row factory for message queries joined with the chat title"""
+    return {
+        'chat_id': row[0],
+        'type': row[1],
+        'content': row[2],
+        'timestamp': row[3],
+        'chat_title': row[4]
+    }
+
+class _LRUCache:
+    """Small thread-safe LRU map for repeated key lookups"""
+    
+    MISSING = object()
+    
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return self.MISSING
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class _SnapshotCache:
+    """Single cached query result that expires after ttl seconds.
+    
+    generation is bumped on every invalidation, so it also serves as a
+    version number for the underlying data.
+    """
+    
+    MISSING = _LRUCache.MISSING
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.generation = 0
+        self._value = self.MISSING
+        self._expires = 0.0
+    
+    def get(self):
+        if time.monotonic() >= self._expires:
+            return self.MISSING
+        return self._value
+    
+    def put(self, value):
+        self._value = value
+        self._expires = time.monotonic() + self.ttl
+    
+    def clear(self):
+        self.generation += 1
+        self._value = self.MISSING
+        self._expires = 0.0
+
 class DatabaseManager:
     def __init__(self, db_path: str = "coworker_chats.db"):
         """Initialize database connection and create tables"""
         self.db_path = db_path
+        self._lock = threading.RLock()
+        self._fts_enabled = False
+        self._memory_cache = _LRUCache(LOOKUP_CACHE_SIZE)
+        self._chat_info_cache = _LRUCache(LOOKUP_CACHE_SIZE)
+        self._all_memory_cache = _SnapshotCache(SNAPSHOT_CACHE_TTL)
+        self._all_chats_cache = _SnapshotCache(SNAPSHOT_CACHE_TTL)
+        # Keeps data versions from different runs from colliding
+        self._version_prefix = format(_now_ms(), 'x')
+        self._conn = self._connect()
         self.init_database()
+        
+        # add_message only enqueues; this thread coalesces the writes
+        self._write_queue = queue.Queue()
+        # Guards _closed against add_message, so nothing is queued behind the stop marker
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the standard PRAGMAs applied"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            isolation_level=None  # autocommit; writes use explicit BEGIN IMMEDIATE
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """Borrow the shared connection for reads"""
+        with self._lock:
+            yield self._conn
+    
+    @contextmanager
+    def _transaction(self):
+        """Borrow the shared connection inside a write transaction.
+        
+        BEGIN IMMEDIATE takes the write lock up front instead of upgrading a
+        deferred transaction halfway through, which can fail with SQLITE_BUSY.
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+    
+    def _writer_loop(self):
+        """Drain queued messages and commit them in batches"""
+        while True:
+            batch = [self._write_queue.get()]
+            if batch[0] is None:
+                self._write_queue.task_done()
+                return
+            
+            deadline = time.monotonic() + WRITE_BATCH_WAIT
+            while len(batch) < WRITE_BATCH_SIZE and batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            stop = batch[-1] is None
+            rows = batch[:-1] if stop else batch
+            try:
+                if rows:
+                    self._write_batch(rows)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+            
+            if stop:
+                return
+    
+    def _write_batch(self, rows: List[tuple]):
+        """Commit queued rows, retrying the batch and then falling back to one row at a time"""
+        for attempt in range(WRITE_BATCH_ATTEMPTS):
+            try:
+                self._insert_messages(rows)
+                logger.debug("Wrote %d queued messages", len(rows))
+                return
+            except Exception as e:
+                logger.warning(f"Error writing {len(rows)} queued messages (attempt {attempt + 1}): {e}")
+        
+        for row in rows:
+            try:
+                self._insert_messages([row])
+            except Exception as e:
+                logger.error(f"Dropped queued message for chat {row[0]}: {e}")
+    
+    def flush(self):
+        """Block until every queued message has been committed"""
+        self._write_queue.join()
+    
+    def close(self):
+        """Write out queued messages and close the shared connection"""
+        with self._write_lock:
+            self._closed = True
+            if self._writer.is_alive():
+                self._write_queue.put(None)
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
     
     def init_database(self):
         """Create database and tables if they don't exist"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            # page_size has to be set before anything is written; WAL lets
+            # readers run alongside a writer and is persisted in the file
+            if self.db_path != ":memory:":
+                with self._connection() as conn:
+                    conn.execute(f'PRAGMA page_size={PAGE_SIZE}')
+                    conn.execute('PRAGMA journal_mode=WAL')
+            
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 
                 # Create chats table
-                cursor.execute('''
+                cursor.execute(f'''
                     CREATE TABLE IF NOT EXISTS chats (
                         id TEXT PRIMARY KEY,
                         title TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at INTEGER DEFAULT {EPOCH_MS_DEFAULT},
+                        updated_at INTEGER DEFAULT {EPOCH_MS_DEFAULT}
                     )
                 ''')
                 
                 # Create messages table
-                cursor.execute('''
+                cursor.execute(f'''
                     CREATE TABLE IF NOT EXISTS messages (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         chat_id TEXT NOT NULL,
                         type TEXT NOT NULL CHECK (type IN ('user', 'ai')),
                         content TEXT NOT NULL,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        timestamp INTEGER DEFAULT {EPOCH_MS_DEFAULT},
                         FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE
                     )
                 ''')
                 
                 # Create user_memory table for persistent user info
-                cursor.execute('''
+                cursor.execute(f'''
                     CREATE TABLE IF NOT EXISTS user_memory (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         key TEXT UNIQUE NOT NULL,
                         value TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at INTEGER DEFAULT {EPOCH_MS_DEFAULT},
+                        updated_at INTEGER DEFAULT {EPOCH_MS_DEFAULT}
                     )
                 ''')
                 
                 # Create indexes for better performance
+                # (chat_id, timestamp) serves both the per-chat lookup and its
+                # ORDER BY, so the old single-column chat_id index is redundant
                 cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_messages_chat_id 
-                    ON messages(chat_id)
+                    CREATE INDEX IF NOT EXISTS idx_messages_chat_ts 
+                    ON messages(chat_id, timestamp)
                 ''')
                 
+                cursor.execute('DROP INDEX IF EXISTS idx_messages_chat_id')
+                
+                for statement in COUNTER_SCHEMA:
+                    cursor.execute(statement)
+                
+                self._init_fts(cursor)
+                self._migrate(cursor)
+                
                 cursor.execute('''
                     CREATE INDEX IF NOT EXISTS idx_messages_timestamp 
                     ON messages(timestamp)
@@ -68,119 +467,203 @@ class DatabaseManager:
                     ON chats(updated_at)
                 ''')
                 
-                conn.commit()
-                logger.info("Database initialized successfully")
+            with self._connection() as conn:
+                conn.execute('PRAGMA optimize')
+            logger.info("Database initialized successfully")
                 
         except Exception as e:
             logger.error(f"Database initialization error: {e}")
             raise
     
+    def _migrate(self, cursor):
+        """Bring data written by older versions up to SCHEMA_VERSION"""
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        
+        if version < 1:
+            # Older rows hold local-time ISO strings; convert them to epoch ms
+            # so they sort alongside new INTEGER timestamps
+            to_ms = "CAST(ROUND((julianday({0}, 'utc') - 2440587.5) * 86400000) AS INTEGER)"
+            for table, columns in (
+                ('chats', ('created_at', 'updated_at')),
+                ('messages', ('timestamp',)),
+                ('user_memory', ('created_at', 'updated_at')),
+            ):
+                for column in columns:
+                    cursor.execute(
+                        f"UPDATE {table} SET {column} = {to_ms.format(column)} "
+                        f"WHERE typeof({column}) = 'text'"
+                    )
+            logger.info("Migrated stored timestamps to epoch milliseconds")
+        
+        if version < 2:
+            # Seed the trigger-maintained counters from the existing rows
+            cursor.execute('''
+                INSERT OR REPLACE INTO counters (name, value) VALUES
+                    ('chats', (SELECT COUNT(*) FROM chats)),
+                    ('messages', (SELECT COUNT(*) FROM messages))
+            ''')
+        
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    
+    def _init_fts(self, cursor):
+        """Create the FTS5 search index, falling back to LIKE if FTS5 is unavailable"""
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+            exists = cursor.fetchone() is not None
+            
+            for statement in FTS_SCHEMA:
+                cursor.execute(statement)
+            
+            # Index messages written before the FTS table existed
+            if not exists:
+                cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+            
+            self._fts_enabled = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable, message search will use LIKE: {e}")
+    
     def create_chat(self, chat_id: str, title: str = "New Conversation") -> bool:
         """Create a new chat"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            now = _now_ms()
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 
-                # Check if chat already exists
-                cursor.execute('SELECT id FROM chats WHERE id = ?', (chat_id,))
-                if cursor.fetchone():
-                    # Chat exists, just update the title
-                    cursor.execute('''
-                        UPDATE chats SET title = ?, updated_at = ?
-                        WHERE id = ?
-                    ''', (title, datetime.now(), chat_id))
-                else:
-                    # Create new chat
-                    cursor.execute('''
-                        INSERT INTO chats (id, title, created_at, updated_at)
-                        VALUES (?, ?, ?, ?)
-                    ''', (chat_id, title, datetime.now(), datetime.now()))
-                
-                conn.commit()
-                logger.info(f"Chat created/updated: {chat_id}")
+                # Create the chat, or just update the title if it already exists
+                cursor.execute(SQL_CREATE_CHAT, (chat_id, title, now, now))
+                self._chat_info_cache.pop(chat_id)
+                self._all_chats_cache.clear()
+                logger.debug("Chat created/updated: %s", chat_id)
                 return True
         except Exception as e:
             logger.error(f"Error creating chat: {e}")
             return False
     
+    def _insert_messages(self, rows: List[tuple]):
+        """Insert (chat_id, type, content, timestamp) rows in one transaction,
+        creating or touching each chat they belong to"""
+        chats = {}
+        for row in rows:
+            chats[row[0]] = row[3]
+        
+        with self._transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Create the chat if needed, otherwise bump its updated_at timestamp
+            cursor.executemany(SQL_UPSERT_CHAT, [
+                (chat_id, "New Conversation", now, now) for chat_id, now in chats.items()
+            ])
+            
+            cursor.executemany(SQL_INSERT_MESSAGE, rows)
+            for chat_id in chats:
+                self._chat_info_cache.pop(chat_id)
+            self._all_chats_cache.clear()
+    
     def add_message(self, chat_id: str, message_type: str, content: str) -> bool:
-        """Add a message to a chat"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Ensure chat exists
-                cursor.execute('SELECT id FROM chats WHERE id = ?', (chat_id,))
-                if not cursor.fetchone():
-                    # Create chat if it doesn't exist
-                    self.create_chat(chat_id)
-                
-                # Add the message
-                cursor.execute('''
-                    INSERT INTO messages (chat_id, type, content, timestamp)
-                    VALUES (?, ?, ?, ?)
-                ''', (chat_id, message_type, content, datetime.now()))
-                
-                # Update chat's updated_at timestamp
-                cursor.execute('''
-                    UPDATE chats SET updated_at = ? WHERE id = ?
-                ''', (datetime.now(), chat_id))
-                
-                conn.commit()
-                logger.info(f"Message added to chat {chat_id}: {message_type}")
+        """Queue a message for the background writer.
+        
+        The write is committed within WRITE_BATCH_WAIT; reads on this manager
+        flush first, and callers that need it on disk can call flush().
+        """
+        if message_type not in MESSAGE_TYPES:
+            logger.error(f"Error adding message: invalid message type {message_type!r}")
+            return False
+        if content is None:
+            logger.error(f"Error adding message: no content for chat {chat_id}")
+            return False
+        
+        row = (chat_id, message_type, content, _now_ms())
+        with self._write_lock:
+            if self._closed:
+                logger.error("Error adding message: database is closed")
+                return False
+            if self._writer.is_alive():
+                self._write_queue.put(row)
+                logger.debug("Message queued for chat %s: %s", chat_id, message_type)
                 return True
+        
+        # The writer thread is gone, so nothing would drain the queue; write directly
+        try:
+            self._insert_messages([row])
+            return True
         except Exception as e:
             logger.error(f"Error adding message: {e}")
             return False
     
+    def add_messages_bulk(self, chat_id: str, messages: List[Dict]) -> bool:
+        """Add several messages to a chat in a single transaction
+        
+        Each message needs 'role' and 'content'; an existing 'timestamp'
+        (e.g. from an export) is kept.
+        """
+        try:
+            # Keep ordering with anything already queued by add_message
+            self.flush()
+            
+            now = _now_ms()
+            rows = [
+                (chat_id, message['role'], message['content'], _to_epoch_ms(message.get('timestamp')) or now)
+                for message in messages
+            ]
+            self._insert_messages(rows)
+            logger.debug("Added %d messages to chat %s", len(rows), chat_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error adding messages: {e}")
+            return False
+    
     def get_chat_history(self, chat_id: str, limit: int = None) -> List[Dict]:
         """Get all messages for a specific chat"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                
-                query = '''
-                    SELECT type, content, timestamp FROM messages 
-                    WHERE chat_id = ? ORDER BY timestamp ASC
-                '''
-                params = [chat_id]
+                cursor.row_factory = _history_row
                 
                 if limit:
-                    query += ' LIMIT ?'
-                    params.append(limit)
+                    cursor.execute(SQL_GET_HISTORY_LIMIT, (chat_id, limit))
+                else:
+                    cursor.execute(SQL_GET_HISTORY, (chat_id,))
                 
-                cursor.execute(query, params)
+                messages = cursor.fetchall()
                 
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'role': row[0],  # 'user' or 'ai'
-                        'content': row[1],
-                        'timestamp': row[2]
-                    })
-                
-                logger.info(f"Retrieved {len(messages)} messages for chat {chat_id}")
+                logger.debug("Retrieved %d messages for chat %s", len(messages), chat_id)
                 return messages
         except Exception as e:
             logger.error(f"Error getting chat history: {e}")
             return []
     
+    def iter_chat_history(self, chat_id: str, batch_size: int = HISTORY_BATCH_SIZE) -> Iterator[Dict]:
+        """Stream messages for a chat without loading the whole history into memory"""
+        self.flush()
+        try:
+            # The lock is only held per batch so a slow consumer doesn't block other queries
+            with self._lock:
+                cursor = self._conn.cursor()
+                cursor.row_factory = _history_row
+                cursor.execute(SQL_GET_HISTORY, (chat_id,))
+            
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        except Exception as e:
+            logger.error(f"Error streaming chat history: {e}")
+    
     def get_all_chats(self) -> List[Dict]:
         """Get all chats with their latest message"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
+                cached = self._all_chats_cache.get()
+                if cached is not _SnapshotCache.MISSING:
+                    return [dict(chat) for chat in cached]
+                
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT c.id, c.title, c.created_at, c.updated_at,
-                           m.content as last_message, m.timestamp as last_message_time
-                    FROM chats c
-                    LEFT JOIN (
-                        SELECT chat_id, content, timestamp,
-                               ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp DESC) as rn
-                        FROM messages
-                    ) m ON c.id = m.chat_id AND m.rn = 1
-                    ORDER BY c.updated_at DESC
-                ''')
+                cursor.execute(SQL_GET_ALL_CHATS)
                 
                 chats = []
                 for row in cursor.fetchall():
@@ -193,20 +676,36 @@ class DatabaseManager:
                         'last_message_time': row[5]
                     })
                 
-                logger.info(f"Retrieved {len(chats)} chats")
-                return chats
+                logger.debug("Retrieved %d chats", len(chats))
+                self._all_chats_cache.put(chats)
+                return [dict(chat) for chat in chats]
         except Exception as e:
             logger.error(f"Error getting all chats: {e}")
             return []
     
+    def get_chats_version(self) -> str:
+        """Opaque token that changes whenever the chat list may have changed"""
+        self.flush()
+        return f"{self._version_prefix}-{self._all_chats_cache.generation}"
+    
+    def get_user_memory_version(self) -> str:
+        """Opaque token that changes whenever user memory may have changed"""
+        return f"{self._version_prefix}-{self._all_memory_cache.generation}"
+    
     def get_user_memory(self, key: str) -> Optional[str]:
         """Get stored user information"""
+        cached = self._memory_cache.get(key)
+        if cached is not _LRUCache.MISSING:
+            return cached
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT value FROM user_memory WHERE key = ?', (key,))
+                cursor.execute(SQL_GET_USER_MEMORY, (key,))
                 result = cursor.fetchone()
-                return result[0] if result else None
+                value = result[0] if result else None
+                self._memory_cache.put(key, value)
+                return value
         except Exception as e:
             logger.error(f"Error getting user memory: {e}")
             return None
@@ -214,14 +713,31 @@ class DatabaseManager:
     def set_user_memory(self, key: str, value: str) -> bool:
         """Store user information that persists across chats"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            now = _now_ms()
+            with self._transaction() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO user_memory (key, value, updated_at)
-                    VALUES (?, ?, ?)
-                ''', (key, value, datetime.now()))
-                conn.commit()
-                logger.info(f"User memory updated: {key} = {value}")
+                cursor.execute(SQL_SET_USER_MEMORY, (key, value, now, now))
+                self._memory_cache.pop(key)
+                self._all_memory_cache.clear()
+                logger.debug("User memory updated: %s = %s", key, value)
+                return True
+        except Exception as e:
+            logger.error(f"Error setting user memory: {e}")
+            return False
+    
+    def set_user_memory_bulk(self, memory: Dict[str, str]) -> bool:
+        """Store several user memory entries in a single transaction"""
+        try:
+            now = _now_ms()
+            with self._transaction() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(SQL_SET_USER_MEMORY, [
+                    (key, value, now, now) for key, value in memory.items()
+                ])
+                for key in memory:
+                    self._memory_cache.pop(key)
+                self._all_memory_cache.clear()
+                logger.debug("User memory updated: %s", ", ".join(memory))
                 return True
         except Exception as e:
             logger.error(f"Error setting user memory: {e}")
@@ -230,10 +746,16 @@ class DatabaseManager:
     def get_all_user_memory(self) -> Dict[str, str]:
         """Get all stored user information"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
+                cached = self._all_memory_cache.get()
+                if cached is not _SnapshotCache.MISSING:
+                    return dict(cached)
+                
                 cursor = conn.cursor()
-                cursor.execute('SELECT key, value FROM user_memory ORDER BY key')
-                return dict(cursor.fetchall())
+                cursor.execute(SQL_GET_ALL_USER_MEMORY)
+                memory = dict(cursor.fetchall())
+                self._all_memory_cache.put(memory)
+                return dict(memory)
         except Exception as e:
             logger.error(f"Error getting all user memory: {e}")
             return {}
@@ -241,14 +763,15 @@ class DatabaseManager:
     def delete_user_memory(self, key: str) -> bool:
         """Delete specific user memory"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM user_memory WHERE key = ?', (key,))
                 deleted = cursor.rowcount > 0
-                conn.commit()
+                self._memory_cache.pop(key)
+                self._all_memory_cache.clear()
                 
                 if deleted:
-                    logger.info(f"User memory deleted: {key}")
+                    logger.debug("User memory deleted: %s", key)
                 
                 return deleted
         except Exception as e:
@@ -257,33 +780,35 @@ class DatabaseManager:
     
     def delete_chat(self, chat_id: str) -> bool:
         """Delete a chat and all its messages"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 
-                # Check if chat exists
-                cursor.execute('SELECT id FROM chats WHERE id = ?', (chat_id,))
-                if not cursor.fetchone():
-                    return False
-                
                 # Delete chat (messages will be deleted due to CASCADE)
                 cursor.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
-                conn.commit()
+                deleted = cursor.rowcount > 0
+                self._chat_info_cache.pop(chat_id)
+                self._all_chats_cache.clear()
                 
-                logger.info(f"Chat deleted: {chat_id}")
-                return True
+                if deleted:
+                    logger.debug("Chat deleted: %s", chat_id)
+                
+                return deleted
         except Exception as e:
             logger.error(f"Error deleting chat: {e}")
             return False
     
     def clear_all_chats(self) -> bool:
         """Clear all chats and messages"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM messages')
                 cursor.execute('DELETE FROM chats')
-                conn.commit()
+                self._chat_info_cache.clear()
+                self._all_chats_cache.clear()
                 logger.info("All chats cleared")
                 return True
         except Exception as e:
@@ -293,10 +818,11 @@ class DatabaseManager:
     def clear_all_user_memory(self) -> bool:
         """Clear all user memory"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM user_memory')
-                conn.commit()
+                self._memory_cache.clear()
+                self._all_memory_cache.clear()
                 logger.info("All user memory cleared")
                 return True
         except Exception as e:
@@ -305,23 +831,27 @@ class DatabaseManager:
     
     def get_chat_info(self, chat_id: str) -> Optional[Dict]:
         """Get basic chat information"""
+        self.flush()
+        cached = self._chat_info_cache.get(chat_id)
+        if cached is not _LRUCache.MISSING:
+            return dict(cached) if cached else None
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT id, title, created_at, updated_at
-                    FROM chats WHERE id = ?
-                ''', (chat_id,))
+                cursor.execute(SQL_GET_CHAT_INFO, (chat_id,))
                 
                 row = cursor.fetchone()
+                chat_info = None
                 if row:
-                    return {
+                    chat_info = {
                         'id': row[0],
                         'title': row[1],
                         'created_at': row[2],
                         'updated_at': row[3]
                     }
-                return None
+                self._chat_info_cache.put(chat_id, chat_info)
+                return dict(chat_info) if chat_info else None
         except Exception as e:
             logger.error(f"Error getting chat info: {e}")
             return None
@@ -329,18 +859,19 @@ class DatabaseManager:
     def update_chat_title(self, chat_id: str, title: str) -> bool:
         """Update chat title"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE chats SET title = ?, updated_at = ?
                     WHERE id = ?
-                ''', (title, datetime.now(), chat_id))
+                ''', (title, _now_ms(), chat_id))
                 
                 updated = cursor.rowcount > 0
-                conn.commit()
+                self._chat_info_cache.pop(chat_id)
+                self._all_chats_cache.clear()
                 
                 if updated:
-                    logger.info(f"Chat title updated: {chat_id} -> {title}")
+                    logger.debug("Chat title updated: %s -> %s", chat_id, title)
                 
                 return updated
         except Exception as e:
@@ -349,29 +880,20 @@ class DatabaseManager:
     
     def search_messages(self, search_term: str, limit: int = 50) -> List[Dict]:
         """Search for messages containing the search term"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT m.chat_id, m.type, m.content, m.timestamp, c.title
-                    FROM messages m
-                    JOIN chats c ON m.chat_id = c.id
-                    WHERE m.content LIKE ?
-                    ORDER BY m.timestamp DESC
-                    LIMIT ?
-                ''', (f'%{search_term}%', limit))
+                cursor.row_factory = _message_with_chat_row
                 
-                results = []
-                for row in cursor.fetchall():
-                    results.append({
-                        'chat_id': row[0],
-                        'type': row[1],
-                        'content': row[2],
-                        'timestamp': row[3],
-                        'chat_title': row[4]
-                    })
+                if self._fts_enabled and search_term.strip():
+                    cursor.execute(SQL_SEARCH_MESSAGES_FTS, (_fts_query(search_term), limit))
+                else:
+                    cursor.execute(SQL_SEARCH_MESSAGES_LIKE, (f'%{search_term}%', limit))
+                
+                results = cursor.fetchall()
                 
-                logger.info(f"Found {len(results)} messages matching '{search_term}'")
+                logger.debug("Found %d messages matching '%s'", len(results), search_term)
                 return results
         except Exception as e:
             logger.error(f"Error searching messages: {e}")
@@ -379,9 +901,11 @@ class DatabaseManager:
     
     def get_recent_messages(self, limit: int = 20) -> List[Dict]:
         """Get recent messages across all chats"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = _message_with_chat_row
                 cursor.execute('''
                     SELECT m.chat_id, m.type, m.content, m.timestamp, c.title
                     FROM messages m
@@ -390,15 +914,7 @@ class DatabaseManager:
                     LIMIT ?
                 ''', (limit,))
                 
-                messages = []
-                for row in cursor.fetchall():
-                    messages.append({
-                        'chat_id': row[0],
-                        'type': row[1],
-                        'content': row[2],
-                        'timestamp': row[3],
-                        'chat_title': row[4]
-                    })
+                messages = cursor.fetchall()
                 
                 return messages
         except Exception as e:
@@ -407,10 +923,11 @@ class DatabaseManager:
     
     def get_chat_count(self) -> int:
         """Get total number of chats"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM chats')
+                cursor.execute(SQL_GET_COUNTER, ('chats',))
                 return cursor.fetchone()[0]
         except Exception as e:
             logger.error(f"Error getting chat count: {e}")
@@ -418,13 +935,15 @@ class DatabaseManager:
     
     def get_message_count(self, chat_id: str = None) -> int:
         """Get total number of messages, optionally for a specific chat"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 if chat_id:
+                    # Answered from the (chat_id, timestamp) index alone
                     cursor.execute('SELECT COUNT(*) FROM messages WHERE chat_id = ?', (chat_id,))
                 else:
-                    cursor.execute('SELECT COUNT(*) FROM messages')
+                    cursor.execute(SQL_GET_COUNTER, ('messages',))
                 return cursor.fetchone()[0]
         except Exception as e:
             logger.error(f"Error getting message count: {e}")
@@ -432,15 +951,21 @@ class DatabaseManager:
     
     def backup_database(self, backup_path: str = None) -> bool:
         """Create a backup of the database"""
+        self.flush()
         try:
             if not backup_path:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 backup_path = f"coworker_chats_backup_{timestamp}.db"
             
-            # Create backup using sqlite3 backup API
-            with sqlite3.connect(self.db_path) as source:
-                with sqlite3.connect(backup_path) as backup:
-                    source.backup(backup)
+            # Copy with the online backup API on a dedicated connection so the
+            # shared connection stays free; under WAL writers keep going while
+            # pages are copied in small steps
+            with closing(self._connect()) as source, closing(sqlite3.connect(backup_path)) as backup:
+                source.backup(backup, pages=BACKUP_PAGES_PER_STEP, sleep=0)
+                # The copy inherits WAL from the source; a standalone backup
+                # file is simpler as a rollback-journal database with no -wal/-shm
+                backup.execute('PRAGMA journal_mode=DELETE')
+                backup.execute('VACUUM')
             
             logger.info(f"Database backed up to: {backup_path}")
             return True
@@ -448,33 +973,42 @@ class DatabaseManager:
             logger.error(f"Error creating backup: {e}")
             return False
     
+    def maintenance(self) -> bool:
+        """Run periodic housekeeping so the query planner stats stay fresh"""
+        try:
+            with self._connection() as conn:
+                conn.execute('PRAGMA optimize')
+                if self.db_path != ":memory:":
+                    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            logger.info("Database maintenance completed")
+            return True
+        except Exception as e:
+            logger.error(f"Error during database maintenance: {e}")
+            return False
+    
     def get_current_timestamp(self) -> str:
         """Get current timestamp in ISO format"""
         return datetime.now().isoformat()
     
     def cleanup_old_chats(self, days_old: int = 30) -> int:
         """Remove chats older than specified days with no messages"""
+        self.flush()
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 
-                # Find chats older than X days with no messages
+                # Delete chats older than X days with no messages in one statement
                 cursor.execute('''
-                    SELECT c.id FROM chats c
-                    LEFT JOIN messages m ON c.id = m.chat_id
-                    WHERE c.created_at < datetime('now', '-{} days')
-                    AND m.id IS NULL
-                '''.format(days_old))
+                    DELETE FROM chats
+                    WHERE created_at < ?
+                    AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.chat_id = chats.id)
+                ''', (_now_ms() - days_old * MS_PER_DAY,))
                 
-                old_chat_ids = [row[0] for row in cursor.fetchall()]
-                
-                # Delete these chats
-                for chat_id in old_chat_ids:
-                    cursor.execute('DELETE FROM chats WHERE id = ?', (chat_id,))
-                
-                conn.commit()
-                logger.info(f"Cleaned up {len(old_chat_ids)} old empty chats")
-                return len(old_chat_ids)
+                removed = cursor.rowcount
+                self._chat_info_cache.clear()
+                self._all_chats_cache.clear()
+                logger.info(f"Cleaned up {removed} old empty chats")
+                return removed
                 
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
@@ -514,13 +1048,9 @@ class DatabaseManager:
             if not success:
                 return False
             
-            # Add all messages
-            for message in messages:
-                self.add_message(
-                    chat_info['id'],
-                    message['role'],
-                    message['content']
-                )
+            # Add all messages in one transaction
+            if not self.add_messages_bulk(chat_info['id'], messages):
+                return False
             
             logger.info(f"Imported chat: {chat_info['id']} with {len(messages)} messages")
             return True
@@ -529,5 +1059,16 @@ class DatabaseManager:
             logger.error(f"Error importing chat data: {e}")
             return False
 
-# Create global database instance
-db_manager = DatabaseManager()
\ No newline at end of file
+# Global database instance, created on first use so importing this module
+# doesn't touch the filesystem
+_db_manager: Optional[DatabaseManager] = None
+_db_manager_lock = threading.Lock()
+
+def get_db_manager() -> DatabaseManager:
+    """Return the shared DatabaseManager, creating it on first call"""
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager()
+    return _db_manager
\ No newline at end of file
@@ -1,13 +1,110 @@
-from fastapi import APIRouter, Request, HTTPException
-from app.services.gemini_service import ai_service
-from app.models.database import db_manager
+from fastapi import APIRouter, Request, Response, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from app.services.gemini_service import get_service
+from app.models.database import get_db_manager
 import re
+import asyncio
+import json
 import uuid
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Greeting, "what do you know about me" and self-describing phrases, matched in one pass.
+# The "self" alternatives cover every user-info extraction pattern: first-person
+# phrases, speaker introductions ("this is" / "name's") and the age and location
+# patterns that need no pronoun ("25 years old", "living in Paris"), so queries
+# without a "self" hit skip extraction
+QUERY_KEYWORD_PATTERN = re.compile(
+    r"\b(?:(?P<greeting>hello|hi|hey|good (?:morning|afternoon|evening))\b"
+    r"|(?P<memory>remember|know about me|who am i|my name|about me)"
+    r"|(?P<self>i|my|me|this is|name's|years?\s+old|located in|living in)\b)"
+)
+
+# Basic, non-sensitive memory keys that may be added to the prompt
+SAFE_MEMORY_KEYS = frozenset({'name', 'interests', 'profession'})
+
+async def prepare_chat_query(query: str, chat_id: str = None):
+    """Resolve the chat, store any personal info and build the prompt for the AI.
+    
+    Returns (chat_id, full_query, conversation_history, user_memory).
+    """
+    # If no chat_id provided, start a new one; the chat row is created
+    # together with its first messages in the same transaction
+    if not chat_id:
+        chat_id = f"chat_{uuid.uuid4().hex[:8]}"
+        conversation_history = []
+    else:
+        # Get conversation history from database (limit to last 10 messages to avoid token limits)
+        conversation_history = get_db_manager().get_chat_history(chat_id, limit=10)
+    
+    # Check if user is sharing new personal info to remember
+    query_lower = query.lower()
+    keyword_hits = classify_query(query_lower)
+    await extract_and_store_user_info(query, query_lower, keyword_hits)
+    
+    # Build context more intelligently
+    memory_context = ""
+    user_memory = get_db_manager().get_all_user_memory()
+    
+    # Only add memory context if it's relevant to the query or if it's a greeting
+    asks_about_memory = "memory" in keyword_hits
+    
+    should_include_memory = (
+        "greeting" in keyword_hits or
+        asks_about_memory or
+        len(conversation_history) == 0  # First message in conversation
+    )
+    
+    if user_memory and should_include_memory:
+        # Only include basic, non-sensitive information, cleaned and length-limited
+        memory_summary = ", ".join(
+            f"User's {key} is {clean_value}"
+            for key, value in user_memory.items()
+            if key in SAFE_MEMORY_KEYS and value
+            for clean_value in (str(value).strip(),)
+            if clean_value and len(clean_value) < 100  # Reasonable length limit
+        )
+        if memory_summary:
+            memory_context = f"Context: {memory_summary}. "
+    
+    # Build full prompt with safer context
+    # For queries asking about user info, use a different approach to avoid safety blocks
+    if memory_context and asks_about_memory:
+        # Instead of adding context directly to the query, let the AI naturally reference the conversation
+        # This avoids triggering safety filters
+        full_query = f"Based on our previous conversations, {query}"
+    elif memory_context:
+        full_query = f"{memory_context}{query}"
+    else:
+        full_query = query
+    
+    # Log for debugging (remove in production)
+    logger.info(f"Query: {query}")
+    logger.info(f"Conversation history length: {len(conversation_history)}")
+    
+    return chat_id, full_query, conversation_history, user_memory
+
+def classify_query(query_lower: str) -> set:
+    """Tag a lowercased query with 'greeting', 'memory' and/or 'self' in a single scan"""
+    hits = {match.lastgroup for match in QUERY_KEYWORD_PATTERN.finditer(query_lower)}
+    if "memory" in hits:
+        # Most memory phrases contain "i" / "my" / "me", which that match consumed
+        hits.add("self")
+    return hits
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """True when the client's If-None-Match already names this ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+def _sse_event(data: dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"data: {json.dumps(data)}\n\n"
+
 @router.post("/ask")  
 async def ask_ai(request: Request):
     try:
@@ -18,70 +115,12 @@ async def ask_ai(request: Request):
         if not query:
             raise HTTPException(status_code=400, detail="Query is required")
         
-        # If no chat_id provided, create a new one
-        if not chat_id:
-            chat_id = f"chat_{uuid.uuid4().hex[:8]}"
-            success = db_manager.create_chat(chat_id, "New Conversation")
-            if not success:
-                raise HTTPException(status_code=500, detail="Failed to create chat")
-        
-        # Get conversation history from database (limit to last 10 messages to avoid token limits)
-        conversation_history = db_manager.get_chat_history(chat_id, limit=10)
-        
-        # Check if user is sharing new personal info to remember
-        await extract_and_store_user_info(query)
-        
-        # Build context more intelligently
-        memory_context = ""
-        user_memory = db_manager.get_all_user_memory()
-        
-        # Only add memory context if it's relevant to the query or if it's a greeting
-        query_lower = query.lower()
-        greeting_keywords = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
-        memory_keywords = ['remember', 'know about me', 'who am i', 'my name', 'about me']
-        
-        should_include_memory = (
-            any(keyword in query_lower for keyword in greeting_keywords) or
-            any(keyword in query_lower for keyword in memory_keywords) or
-            len(conversation_history) == 0  # First message in conversation
-        )
-        
-        if user_memory and should_include_memory:
-            # Filter memory to only include safe, relevant information
-            safe_memory = {}
-            for key, value in user_memory.items():
-                # Only include basic, non-sensitive information
-                if key in ['name', 'interests', 'profession'] and value:
-                    # Clean the value to ensure it's safe
-                    clean_value = str(value).strip()
-                    if clean_value and len(clean_value) < 100:  # Reasonable length limit
-                        safe_memory[key] = clean_value
-            
-            if safe_memory:
-                memory_context = "Context: "
-                memory_parts = []
-                for key, value in safe_memory.items():
-                    memory_parts.append(f"User's {key} is {value}")
-                memory_context += ", ".join(memory_parts) + ". "
-        
-        # Build full prompt with safer context
-        # For queries asking about user info, use a different approach to avoid safety blocks
-        if memory_context and any(keyword in query_lower for keyword in memory_keywords):
-            # Instead of adding context directly to the query, let the AI naturally reference the conversation
-            # This avoids triggering safety filters
-            full_query = f"Based on our previous conversations, {query}"
-        elif memory_context:
-            full_query = f"{memory_context}{query}"
-        else:
-            full_query = query
-        
-        # Log for debugging (remove in production)
-        logger.info(f"Query: {query}")
-        logger.info(f"Conversation history length: {len(conversation_history)}")
+        chat_id, full_query, conversation_history, user_memory = await prepare_chat_query(query, chat_id)
         
         # Use AI service for all questions - it now handles safety issues internally
+        # (blocking network call, so keep it off the event loop)
         try:
-            answer = ai_service.generate_chat_response(full_query, conversation_history)
+            answer = await asyncio.to_thread(get_service().generate_chat_response, full_query, conversation_history)
         except Exception as e:
             logger.error(f"AI service failed: {e}")
             answer = f"I encountered an error: {str(e)}"
@@ -89,17 +128,13 @@ async def ask_ai(request: Request):
         # If still blocked, try the retry method (without history to avoid context issues)
         if "safety" in answer.lower() or "can't provide" in answer.lower():
             logger.warning("Response was blocked, trying modified prompt without history")
-            answer = ai_service.retry_with_modified_prompt(query)
-        
-        # Store user message in database
-        success = db_manager.add_message(chat_id, "user", query)
-        if not success:
-            logger.warning(f"Failed to store user message for chat {chat_id}")
+            answer = await asyncio.to_thread(get_service().retry_with_modified_prompt, query)
         
-        # Store AI response in database  
-        success = db_manager.add_message(chat_id, "ai", answer)
-        if not success:
-            logger.warning(f"Failed to store AI response for chat {chat_id}")
+        # Queue the user message and AI response for the background writer; this
+        # doesn't block, and reads flush the queue, so the next request sees them
+        db_manager = get_db_manager()
+        db_manager.add_message(chat_id, "user", query)
+        db_manager.add_message(chat_id, "ai", answer)
         
         return {
             "response": answer,
@@ -115,138 +150,213 @@ async def ask_ai(request: Request):
             "response": f"Sorry, I encountered an error: {str(e)}",
             "error": str(e)
         }
-async def extract_and_store_user_info(query: str):
+
+@router.post("/ask/stream")
+async def ask_ai_stream(request: Request, background_tasks: BackgroundTasks):
+    """Same as /ask, but streams the answer as Server-Sent Events while it is generated"""
+    body = await request.json()
+    query = body.get("query", "")
+    
+    if not query:
+        raise HTTPException(status_code=400, detail="Query is required")
+    
+    chat_id, full_query, conversation_history, user_memory = await prepare_chat_query(query, body.get("chat_id"))
+    chunks = []
+    
+    def event_stream():
+        # Sync generator: StreamingResponse iterates it in the threadpool
+        yield _sse_event({"chat_id": chat_id})
+        for chunk in get_service().stream_chat_response(full_query, conversation_history):
+            chunks.append(chunk)
+            yield _sse_event({"chunk": chunk})
+        yield _sse_event({"done": True, "chat_id": chat_id, "memory_updated": bool(user_memory)})
+    
+    def store_exchange():
+        if chunks:
+            get_db_manager().add_messages_bulk(chat_id, [
+                {"role": "user", "content": query},
+                {"role": "ai", "content": "".join(chunks)}
+            ])
+    
+    # Runs once the stream has finished
+    background_tasks.add_task(store_exchange)
+    return StreamingResponse(event_stream(), media_type="text/event-stream", background=background_tasks)
+
+# Patterns used by extract_and_store_user_info, compiled once at import
+# Extract name - More specific patterns
+NAME_PATTERNS = tuple(re.compile(p) for p in (
+    r"my name is (\w+)",
+    r"i'm (\w+)(?:\s+and|\s*,|\s*\.|\s+here)",  # Followed by specific words
+    r"i am (\w+)(?:\s+and|\s*,|\s*\.|\s+here)",
+    r"call me (\w+)",
+    r"name's (\w+)",
+    r"this is (\w+)(?:\s+speaking|\s+here)",
+))
+
+# Extract workplace - More specific
+WORKPLACE_PATTERNS = tuple(re.compile(p) for p in (
+    r"i work at ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
+    r"i work for ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
+    r"i'm employed (?:at|by) ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
+    r"i work at the ([A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)"
+))
+
+# Extract location - More specific
+LOCATION_PATTERNS = tuple(re.compile(p) for p in (
+    r"i live in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
+    r"i'm from ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
+    r"i'm in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
+    r"i'm based in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
+    r"(?:located|living) in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)"
+))
+
+# Extract interests/hobbies - More specific
+INTEREST_PATTERNS = tuple(re.compile(p) for p in (
+    r"i (?:like|love|enjoy) (?:to\s+)?([a-z]+(?:ing)?|[a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+    r"i'm interested in ([a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+    r"my (?:hobby|hobbies) (?:is|are|include) ([a-z\s,]+?)(?:\s+and\s+|\s*\.\s*|$)",
+    r"i'm passionate about ([a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)"
+))
+
+# Extract profession/job title - Fixed to avoid "a" as name
+JOB_PATTERNS = tuple(re.compile(p) for p in (
+    r"i'm a ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+    r"i am a ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+    r"i work as an? ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+    r"my (?:job|profession|role) is ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
+))
+
+# Extract age - More specific
+AGE_PATTERNS = tuple(re.compile(p) for p in (
+    r"i'm (\d+)\s+years?\s+old",
+    r"i am (\d+)\s+years?\s+old",
+    r"my age is (\d+)",
+    r"(\d+)\s+years?\s+old"
+))
+
+# Common words that aren't names / interests / job titles
+EXCLUDED_NAME_WORDS = frozenset({'a', 'an', 'the', 'student', 'teacher', 'person', 'user', 'here', 'back'})
+EXCLUDED_INTEREST_WORDS = frozenset({'a', 'an', 'the', 'to', 'be', 'being', 'do', 'doing', 'have', 'having'})
+EXCLUDED_JOB_WORDS = frozenset({'person', 'individual', 'human', 'user', 'someone', 'a', 'an', 'the'})
+VALID_JOBS = frozenset({
+    'student', 'teacher', 'developer', 'engineer', 'designer', 'manager',
+    'doctor', 'nurse', 'lawyer', 'consultant', 'analyst', 'writer',
+    'software engineer', 'data scientist', 'product manager'
+})
+
+# Literal phrases every pattern in a category needs; a category's regexes
+# only run when one of its triggers occurs in the lowercased query
+USER_INFO_TRIGGERS = {
+    "name": ("my name is", "i'm ", "i am ", "call me ", "name's ", "this is "),
+    "workplace": ("i work ", "i'm employed "),
+    "location": ("i live in ", "i'm from ", "i'm in ", "i'm based in ", "located in ", "living in "),
+    "interests": ("i like ", "i love ", "i enjoy ", "i'm interested in ", "my hobb", "i'm passionate about "),
+    "profession": ("i'm a ", "i am a ", "i work as a", "my job ", "my profession ", "my role "),
+    "age": ("old", "my age is"),
+}
+
+
+async def extract_and_store_user_info(query: str, query_lower: str, keyword_hits: set = None):
     """Extract and store user information from messages"""
-    query_lower = query.lower()
+    if keyword_hits is None:
+        keyword_hits = classify_query(query_lower)
+    if "self" not in keyword_hits:
+        return
     
-    # Extract name - More specific patterns
-    name_patterns = [
-        r"my name is (\w+)",
-        r"i'm (\w+)(?:\s+and|\s*,|\s*\.|\s+here)",  # Followed by specific words
-        r"i am (\w+)(?:\s+and|\s*,|\s*\.|\s+here)",
-        r"call me (\w+)",
-        r"name's (\w+)",
-        r"this is (\w+)(?:\s+speaking|\s+here)",
-    ]
+    categories = {
+        category for category, triggers in USER_INFO_TRIGGERS.items()
+        if any(trigger in query_lower for trigger in triggers)
+    }
+    if not categories:
+        return
     
-    for pattern in name_patterns:
-        match = re.search(pattern, query_lower)
-        if match:
-            name = match.group(1).title()
-            # Exclude common words that aren't names
-            excluded_words = ['a', 'an', 'the', 'student', 'teacher', 'person', 'user', 'here', 'back']
-            if name.lower() not in excluded_words:
-                db_manager.set_user_memory("name", name)
-                logger.info(f"Stored user name: {name}")
-                break
+    # Everything found is written in one transaction at the end
+    updates = {}
     
-    # Extract workplace - More specific
-    workplace_patterns = [
-        r"i work at ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
-        r"i work for ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
-        r"i'm employed (?:at|by) ([A-Z][A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)",
-        r"i work at the ([A-Za-z0-9\s&]+?)(?:\.|,|$|\s+and|\s+in\s+)"
-    ]
+    # Extract name - More specific patterns
+    if "name" in categories:
+        for pattern in NAME_PATTERNS:
+            match = pattern.search(query_lower)
+            if match:
+                name = match.group(1).title()
+                # Exclude common words that aren't names
+                if name.lower() not in EXCLUDED_NAME_WORDS:
+                    updates["name"] = name
+                    logger.info(f"Stored user name: {name}")
+                    break
     
-    for pattern in workplace_patterns:
-        match = re.search(pattern, query)  # Use original case
-        if match:
-            workplace = match.group(1).strip()
-            if len(workplace.split()) <= 8:  # Reasonable company name length
-                db_manager.set_user_memory("workplace", workplace)
-                logger.info(f"Stored workplace: {workplace}")
-                break
+    # Extract workplace - More specific
+    if "workplace" in categories:
+        for pattern in WORKPLACE_PATTERNS:
+            match = pattern.search(query)  # Use original case
+            if match:
+                workplace = match.group(1).strip()
+                if len(workplace.split()) <= 8:  # Reasonable company name length
+                    updates["workplace"] = workplace
+                    logger.info(f"Stored workplace: {workplace}")
+                    break
     
     # Extract location - More specific
-    location_patterns = [
-        r"i live in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
-        r"i'm from ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
-        r"i'm in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
-        r"i'm based in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)",
-        r"(?:located|living) in ([A-Z][A-Za-z\s,]+?)(?:\.|$|\s+and\s+)"
-    ]
-    
-    for pattern in location_patterns:
-        match = re.search(pattern, query)  # Use original case
-        if match:
-            location = match.group(1).strip()
-            if len(location.split()) <= 5:  # Reasonable location length
-                db_manager.set_user_memory("location", location)
-                logger.info(f"Stored location: {location}")
-                break
+    if "location" in categories:
+        for pattern in LOCATION_PATTERNS:
+            match = pattern.search(query)  # Use original case
+            if match:
+                location = match.group(1).strip()
+                if len(location.split()) <= 5:  # Reasonable location length
+                    updates["location"] = location
+                    logger.info(f"Stored location: {location}")
+                    break
     
     # Extract interests/hobbies - More specific
-    interest_patterns = [
-        r"i (?:like|love|enjoy) (?:to\s+)?([a-z]+(?:ing)?|[a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-        r"i'm interested in ([a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-        r"my (?:hobby|hobbies) (?:is|are|include) ([a-z\s,]+?)(?:\s+and\s+|\s*\.\s*|$)",
-        r"i'm passionate about ([a-z\s]+?)(?:\s+and\s+|\s*,\s*|\s*\.\s*|$)"
-    ]
-    
-    for pattern in interest_patterns:
-        match = re.search(pattern, query_lower)
-        if match:
-            interest = match.group(1).strip()
-            # Exclude common verbs/words that aren't interests
-            excluded = ['a', 'an', 'the', 'to', 'be', 'being', 'do', 'doing', 'have', 'having']
-            if interest not in excluded and len(interest.split()) <= 5:
-                existing_interests = db_manager.get_user_memory("interests") or ""
-                if interest not in existing_interests.lower():
-                    new_interests = f"{existing_interests}, {interest}" if existing_interests else interest
-                    db_manager.set_user_memory("interests", new_interests)
-                    logger.info(f"Added interest: {interest}")
-                break
+    if "interests" in categories:
+        for pattern in INTEREST_PATTERNS:
+            match = pattern.search(query_lower)
+            if match:
+                interest = match.group(1).strip()
+                # Exclude common verbs/words that aren't interests
+                if interest not in EXCLUDED_INTEREST_WORDS and len(interest.split()) <= 5:
+                    existing_interests = get_db_manager().get_user_memory("interests") or ""
+                    if interest not in existing_interests.lower():
+                        new_interests = f"{existing_interests}, {interest}" if existing_interests else interest
+                        updates["interests"] = new_interests
+                        logger.info(f"Added interest: {interest}")
+                    break
     
     # Extract profession/job title - Fixed to avoid "a" as name
-    job_patterns = [
-        r"i'm a ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-        r"i am a ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-        r"i work as an? ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-        r"my (?:job|profession|role) is ([a-z\s]+?)(?:\s+at\s+|\s+in\s+|\s+and\s+|\s*,\s*|\s*\.\s*|$)",
-    ]
-    
-    for pattern in job_patterns:
-        match = re.search(pattern, query_lower)
-        if match:
-            job = match.group(1).strip()
-            # Filter out common words and single letters
-            excluded_words = ['person', 'individual', 'human', 'user', 'someone', 'a', 'an', 'the']
-            valid_jobs = ['student', 'teacher', 'developer', 'engineer', 'designer', 'manager', 
-                         'doctor', 'nurse', 'lawyer', 'consultant', 'analyst', 'writer',
-                         'software engineer', 'data scientist', 'product manager']
-            
-            # Check if it's a valid job or contains multiple words (likely a job title)
-            if (len(job) > 2 and job not in excluded_words and 
-                (job in valid_jobs or len(job.split()) >= 2 or job.endswith('er') or job.endswith('ist'))):
-                db_manager.set_user_memory("profession", job)
-                logger.info(f"Stored profession: {job}")
-                break
+    if "profession" in categories:
+        for pattern in JOB_PATTERNS:
+            match = pattern.search(query_lower)
+            if match:
+                job = match.group(1).strip()
+                # Check if it's a valid job or contains multiple words (likely a job title),
+                # filtering out common words and single letters
+                if (len(job) > 2 and job not in EXCLUDED_JOB_WORDS and 
+                    (job in VALID_JOBS or len(job.split()) >= 2 or job.endswith('er') or job.endswith('ist'))):
+                    updates["profession"] = job
+                    logger.info(f"Stored profession: {job}")
+                    break
     
     # Extract age - More specific
-    age_patterns = [
-        r"i'm (\d+)\s+years?\s+old",
-        r"i am (\d+)\s+years?\s+old",
-        r"my age is (\d+)",
-        r"(\d+)\s+years?\s+old"
-    ]
+    if "age" in categories:
+        for pattern in AGE_PATTERNS:
+            match = pattern.search(query_lower)
+            if match:
+                age = match.group(1)
+                if 13 <= int(age) <= 120:  # Reasonable age range
+                    updates["age"] = age
+                    logger.info(f"Stored age: {age}")
+                    break
     
-    for pattern in age_patterns:
-        match = re.search(pattern, query_lower)
-        if match:
-            age = match.group(1)
-            if 13 <= int(age) <= 120:  # Reasonable age range
-                db_manager.set_user_memory("age", age)
-                logger.info(f"Stored age: {age}")
-                break
+    if updates:
+        get_db_manager().set_user_memory_bulk(updates)
+
 @router.get("/chat-history/{chat_id}")
 async def get_chat_history(chat_id: str):
     """Get chat history for a specific chat"""
     try:
-        history = db_manager.get_chat_history(chat_id)
-        
         # FIX: Ensure each message has required fields
         formatted_history = []
-        for msg in history:
+        for msg in get_db_manager().iter_chat_history(chat_id):
             formatted_msg = {
                 "role": msg.get("role", "user"),
                 "content": msg.get("content", ""),
@@ -260,10 +370,15 @@ async def get_chat_history(chat_id: str):
         raise HTTPException(status_code=500, detail="Failed to retrieve chat history")
 
 @router.get("/chats")
-async def get_all_chats():
+async def get_all_chats(request: Request, response: Response):
     """Get all chats"""
     try:
-        chats = db_manager.get_all_chats()
+        etag = f'W/"{get_db_manager().get_chats_version()}"'
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        chats = get_db_manager().get_all_chats()
+        response.headers["ETag"] = etag
         return {"chats": chats}
     except Exception as e:
         logger.error(f"Error getting all chats: {str(e)}")
@@ -280,7 +395,7 @@ async def create_chat(request: Request):
         if not chat_id:
             chat_id = f"chat_{uuid.uuid4().hex[:8]}"
         
-        success = db_manager.create_chat(chat_id, title)
+        success = get_db_manager().create_chat(chat_id, title)
         
         if success:
             return {"success": True, "chat_id": chat_id}
@@ -297,7 +412,7 @@ async def create_chat(request: Request):
 async def delete_chat(chat_id: str):
     """Delete a specific chat"""
     try:
-        success = db_manager.delete_chat(chat_id)
+        success = get_db_manager().delete_chat(chat_id)
         
         if success:
             return {"success": True}
@@ -311,10 +426,15 @@ async def delete_chat(chat_id: str):
         raise HTTPException(status_code=500, detail="Failed to delete chat")
 
 @router.get("/user-memory")
-async def get_user_memory():
+async def get_user_memory(request: Request, response: Response):
     """Get all stored user information"""
     try:
-        memory = db_manager.get_all_user_memory()
+        etag = f'W/"{get_db_manager().get_user_memory_version()}"'
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        memory = get_db_manager().get_all_user_memory()
+        response.headers["ETag"] = etag
         return {"memory": memory}
     except Exception as e:
         logger.error(f"Error getting user memory: {str(e)}")
@@ -331,7 +451,7 @@ async def set_user_memory(request: Request):
         if not key or not value:
             raise HTTPException(status_code=400, detail="Key and value are required")
         
-        success = db_manager.set_user_memory(key, value)
+        success = get_db_manager().set_user_memory(key, value)
         
         if success:
             return {"success": True}
@@ -349,7 +469,7 @@ async def delete_user_memory(key: str):
     """Delete specific user memory"""
     try:
         # Add this method to your DatabaseManager class
-        success = db_manager.delete_user_memory(key)
+        success = get_db_manager().delete_user_memory(key)
         
         if success:
             return {"success": True}
@@ -365,21 +485,20 @@ async def export_chat(chat_id: str):
     """Export a chat as JSON"""
     try:
         # Get chat info
-        chats = db_manager.get_all_chats()
-        chat_info = next((chat for chat in chats if chat['id'] == chat_id), None)
+        chat_info = get_db_manager().get_chat_info(chat_id)
         
         if not chat_info:
             raise HTTPException(status_code=404, detail="Chat not found")
         
         # Get chat history
-        history = db_manager.get_chat_history(chat_id)
+        history = get_db_manager().get_chat_history(chat_id)
         
         export_data = {
             "chat_id": chat_id,
             "title": chat_info['title'],
             "created_at": chat_info['created_at'],
             "messages": history,
-            "exported_at": db_manager.get_current_timestamp()
+            "exported_at": get_db_manager().get_current_timestamp()
         }
         
         return {"export_data": export_data}
@@ -394,16 +513,12 @@ async def export_chat(chat_id: str):
 async def get_stats():
     """Get usage statistics"""
     try:
-        chats = db_manager.get_all_chats()
-        total_chats = len(chats)
+        total_chats = get_db_manager().get_chat_count()
         
         # Count total messages
-        total_messages = 0
-        for chat in chats:
-            history = db_manager.get_chat_history(chat['id'])
-            total_messages += len(history)
+        total_messages = get_db_manager().get_message_count()
         
-        user_memory = db_manager.get_all_user_memory()
+        user_memory = get_db_manager().get_all_user_memory()
         
         return {
             "total_chats": total_chats,
@@ -2,8 +2,9 @@ from fastapi import APIRouter, HTTPException, Request, Depends
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import logging
-from app.services.enhanced_ai_service import EnhancedAIService
-from app.services.microsoft_graph_service import MicrosoftGraphService
+import asyncio
+from app.services.enhanced_ai_service import get_enhanced_ai_service, DAILY_SUMMARY_PROMPT_TEMPLATE
+from app.services.microsoft_graph_service import get_graph_service
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -28,13 +29,14 @@ class QuickActionRequest(BaseModel):
     action: str
     data: Optional[Dict[str, Any]] = None
 
-# Store sessions (use Redis or proper session management in production)
-user_sessions = {}
-
+# Clients send the Microsoft Graph token on every call as
+# "Authorization: Bearer <token>", so no server-side session store is needed
 def get_access_token(request: Request) -> Optional[str]:
-    """Get access token from session"""
-    client_host = request.client.host if request.client else "unknown"
-    return user_sessions.get(client_host, {}).get('access_token')
+    """Get the Microsoft Graph access token from the Authorization: Bearer header"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
 
 def require_auth(request: Request) -> str:
     """Require authentication and return access token"""
@@ -45,22 +47,19 @@ def require_auth(request: Request) -> str:
 
 @router.post("/auth")
 async def authenticate(request: AuthRequest, req: Request):
-    """Store Microsoft Graph access token"""
+    """Validate a Microsoft Graph access token"""
     try:
-        client_host = req.client.host if req.client else "unknown"
-        if client_host not in user_sessions:
-            user_sessions[client_host] = {}
-        user_sessions[client_host]['access_token'] = request.access_token
-        
         # Test the token by making a simple Graph API call
-        graph_service = MicrosoftGraphService(request.access_token)
-        user_info = graph_service.get_user_profile()
+        graph_service = get_graph_service(request.access_token)
+        user_info = await asyncio.to_thread(graph_service.get_user_profile)
         
         if user_info:
             return {
                 "success": True,
                 "message": "Authentication successful",
-                "user": user_info
+                "user": user_info,
+                "access_token": request.access_token,
+                "token_type": "Bearer"
             }
         else:
             raise HTTPException(status_code=401, detail="Invalid access token")
@@ -71,11 +70,7 @@ async def authenticate(request: AuthRequest, req: Request):
 
 @router.post("/logout")
 async def logout(request: Request):
-    """Remove access token from session"""
-    client_host = request.client.host if request.client else "unknown"
-    if client_host in user_sessions:
-        user_sessions[client_host].pop('access_token', None)
-    
+    """Log out (the client just discards its bearer token)"""
     return {"success": True, "message": "Logged out successfully"}
 
 @router.get("/auth/status")
@@ -93,8 +88,8 @@ async def get_teams_messages_today(request: Request):
     """Get today's Teams messages"""
     try:
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
-        result = ai_service._handle_teams_messages_today("Get today's Teams messages")
+        ai_service = get_enhanced_ai_service(access_token)
+        result = await asyncio.to_thread(ai_service._handle_teams_messages_today, "Get today's Teams messages")
         return result
     except HTTPException:
         raise
@@ -107,10 +102,10 @@ async def send_teams_message(data: TeamsMessageRequest, request: Request):
     """Send a Teams message"""
     try:
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
+        ai_service = get_enhanced_ai_service(access_token)
         
         query = f"Send Teams message to {data.recipient}: {data.message}"
-        result = ai_service._handle_teams_send_message(query)
+        result = await asyncio.to_thread(ai_service._handle_teams_send_message, query)
         return result
     except HTTPException:
         raise
@@ -123,8 +118,8 @@ async def get_teams_chats(request: Request):
     """Get Teams chats"""
     try:
         access_token = require_auth(request)
-        graph_service = MicrosoftGraphService(access_token)
-        chats = graph_service.get_teams_chats()
+        graph_service = get_graph_service(access_token)
+        chats = await asyncio.to_thread(graph_service.get_teams_chats)
         return {"chats": chats}
     except HTTPException:
         raise
@@ -143,10 +138,10 @@ async def summarize_teams_chat(request: Request):
             raise HTTPException(status_code=400, detail="chat_id is required")
         
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
+        ai_service = get_enhanced_ai_service(access_token)
         
         query = f"Summarize Teams chat {chat_id}"
-        result = ai_service._handle_teams_summarize(query)
+        result = await asyncio.to_thread(ai_service._handle_teams_summarize, query)
         return result
     except HTTPException:
         raise
@@ -160,8 +155,8 @@ async def get_emails_today(request: Request):
     """Get today's emails"""
     try:
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
-        result = ai_service._handle_emails_today("Get today's emails")
+        ai_service = get_enhanced_ai_service(access_token)
+        result = await asyncio.to_thread(ai_service._handle_emails_today, "Get today's emails")
         return result
     except HTTPException:
         raise
@@ -174,13 +169,13 @@ async def send_email(data: EmailRequest, request: Request):
     """Send an email"""
     try:
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
+        ai_service = get_enhanced_ai_service(access_token)
         
         query = f"Send email to {data.to} with subject '{data.subject}': {data.message}"
         if data.cc:
             query += f" (CC: {data.cc})"
         
-        result = ai_service._handle_email_send(query)
+        result = await asyncio.to_thread(ai_service._handle_email_send, query)
         return result
     except HTTPException:
         raise
@@ -201,10 +196,10 @@ async def draft_email(request: Request):
             raise HTTPException(status_code=400, detail="recipient and topic are required")
         
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
+        ai_service = get_enhanced_ai_service(access_token)
         
         query = f"Draft email to {recipient} about {topic}. Context: {context}"
-        result = ai_service._handle_email_draft(query)
+        result = await asyncio.to_thread(ai_service._handle_email_draft, query)
         return result
     except HTTPException:
         raise
@@ -217,8 +212,8 @@ async def get_email_folders(request: Request):
     """Get email folders"""
     try:
         access_token = require_auth(request)
-        graph_service = MicrosoftGraphService(access_token)
-        folders = graph_service.get_email_folders()
+        graph_service = get_graph_service(access_token)
+        folders = await asyncio.to_thread(graph_service.get_email_folders)
         return {"folders": folders}
     except HTTPException:
         raise
@@ -232,26 +227,21 @@ async def quick_actions(data: QuickActionRequest, request: Request):
     """Handle quick actions"""
     try:
         access_token = require_auth(request)
-        ai_service = EnhancedAIService(access_token)
+        ai_service = get_enhanced_ai_service(access_token)
         
         if data.action == 'daily_summary':
-            # Get both Teams and Outlook summary
-            teams_result = ai_service._handle_teams_messages_today("teams messages today")
-            emails_result = ai_service._handle_emails_today("emails today")
-            
-            summary_prompt = f"""
-            Create a daily summary for the user:
-            
-            Teams Activity:
-            {teams_result.get('response', 'No Teams activity')}
-            
-            Email Activity:
-            {emails_result.get('response', 'No email activity')}
+            # Get both Teams and Outlook summary concurrently
+            teams_result, emails_result = await asyncio.gather(
+                asyncio.to_thread(ai_service._handle_teams_messages_today, "teams messages today"),
+                asyncio.to_thread(ai_service._handle_emails_today, "emails today")
+            )
             
-            Provide a brief, friendly daily overview and ask what they'd like to focus on.
-            """
+            summary_prompt = DAILY_SUMMARY_PROMPT_TEMPLATE.format(
+                teams=teams_result.get('response', 'No Teams activity'),
+                emails=emails_result.get('response', 'No email activity')
+            )
             
-            daily_summary = ai_service.ai_service.generate_response(summary_prompt)
+            daily_summary = await asyncio.to_thread(ai_service.ai_service.generate_response, summary_prompt)
             
             return {
                 "type": "daily_summary",
@@ -284,8 +274,8 @@ async def get_user_profile(request: Request):
     """Get user profile from Microsoft Graph"""
     try:
         access_token = require_auth(request)
-        graph_service = MicrosoftGraphService(access_token)
-        profile = graph_service.get_user_profile()
+        graph_service = get_graph_service(access_token)
+        profile = await asyncio.to_thread(graph_service.get_user_profile)
         return {"profile": profile}
     except HTTPException:
         raise
@@ -1,3 +1,3 @@
-from .gemini_service import ai_service
+from .gemini_service import get_service
 
-__all__ = ['ai_service']
\ No newline at end of file
+__all__ = ['get_service']
\ No newline at end of file
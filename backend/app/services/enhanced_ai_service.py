@@ -1,39 +1,290 @@
 from app.services.microsoft_graph_service import MicrosoftGraphService
-from app.services.gemini_service import GeminiService
+from app.services.gemini_service import CachedAIService, get_service
+import os
 import re
 import json
+import logging
+import threading
+from collections import Counter
 from datetime import datetime
+from functools import lru_cache, cached_property
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
+logger = logging.getLogger(__name__)
+
+# Most per-chat summaries requested from Gemini at once
+SUMMARY_MAX_WORKERS = 8
+
+# Intent detection patterns, in priority order
+INTENT_PATTERNS = {
+    'teams_messages_today': ['teams messages today', 'teams today', 'new messages teams', 'what\'s new in teams'],
+    'outlook_emails_today': ['emails today', 'new emails', 'outlook today', 'mail today'],
+    'send_teams_message': ['send teams message', 'message someone teams', 'teams send'],
+    'send_email': ['send email', 'email someone', 'compose email'],
+    'summarize_teams_chat': ['summarize teams', 'summarize chat', 'teams summary'],
+    'summarize_emails': ['summarize emails', 'email summary', 'summarize mail']
+}
+
+# (pattern, intent) pairs flattened in priority order
+INTENT_PATTERN_LIST = [
+    (pattern, intent)
+    for intent, patterns in INTENT_PATTERNS.items()
+    for pattern in patterns
+]
+
+# Set TRACK_INTENT_HITS=1 to tally detected intents. The counts are logged
+# every INTENT_HITS_LOG_EVERY queries as data for ordering INTENT_PATTERNS.
+# Only patterns within one intent can be reordered freely: moving a whole
+# intent changes which one wins when a query matches several.
+TRACK_INTENT_HITS = os.getenv('TRACK_INTENT_HITS') == '1'
+INTENT_HITS_LOG_EVERY = 1000
+intent_hits = Counter()
+# Queries are handled on worker threads, so counting and logging share a lock
+intent_hits_lock = threading.Lock()
+
+def record_intent_hit(intent: Optional[str]):
+    """Count one detected intent (None for regular AI queries)"""
+    with intent_hits_lock:
+        intent_hits[intent or 'regular_ai'] += 1
+        if intent_hits.total() % INTENT_HITS_LOG_EVERY != 0:
+            return
+        hits = dict(intent_hits.most_common())
+    logger.info("Intent hits: %s", hits)
+
+@lru_cache(maxsize=128)
+def detect_intent(query_lower: str) -> Optional[str]:
+    """Return the intent for a lowercased query, or None for a regular AI query.
+    
+    Cached (misses included) since users repeat the same short commands.
+    """
+    # The first matching pattern belongs to the earliest-listed intent
+    return next((intent for pattern, intent in INTENT_PATTERN_LIST if pattern in query_lower), None)
+
+# Extraction patterns, compiled once at import. Each field's alternatives are
+# fused into one regex so a single scan of the query fills every field; a
+# group named <field>_<n> captures that field's value, and a lower n is the
+# preferred alternative. The alternation sits in a lookahead, so matches are
+# zero-width and never consume text another alternative needs (a recipient
+# and the quoted subject after it, say). Recipient names are capped at 64
+# characters so backtracking stays linear in the query length. Patterns are
+# lowercase and run against the lowercased query, which is cheaper than
+# re.IGNORECASE case folding on every match step.
+# Teams message: quoted content, then recipient
+MESSAGE_INFO_PATTERN = re.compile('(?=' + '|'.join((
+    r'send\s+(?:him|her|them)?\s*["\'](?P<content_0>[^"\']+)["\']',
+    r'message\s+(?:him|her|them)?\s*["\'](?P<content_1>[^"\']+)["\']',
+    r'tell\s+(?:him|her|them)?\s*["\'](?P<content_2>[^"\']+)["\']',
+    r'say\s+["\'](?P<content_3>[^"\']+)["\']',
+    r'(?:to|message)\s+(?P<recipient_0>[a-z\s]{1,64})(?=\s+(?:that|to|about))',
+    r'(?:send|tell)\s+(?P<recipient_1>[a-z\s]{1,64})(?=\s+that)'
+)) + ')')
+
+# Email: quoted body, quoted subject, then recipient address (preferred) or name
+EMAIL_INFO_PATTERN = re.compile('(?=' + '|'.join((
+    r'email\s+(?:him|her|them)?\s*["\'](?P<content_0>[^"\']+)["\']',
+    r'send\s+(?:an\s+)?email\s+["\'](?P<content_1>[^"\']+)["\']',
+    r'compose\s+["\'](?P<content_2>[^"\']+)["\']',
+    r'subject\s+["\'](?P<subject_0>[^"\']+)["\']',
+    r'about\s+["\'](?P<subject_1>[^"\']+)["\']',
+    r'(?:to|email)\s+(?P<recipient_0>[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,})',
+    r'(?:to|email)\s+(?P<recipient_1>[a-z\s]{1,64})(?=\s+(?:that|to|about))'
+)) + ')')
+
+# Fields each fused pattern can fill; a scan stops once it has all of them
+MESSAGE_INFO_FIELDS = frozenset(name.rsplit('_', 1)[0] for name in MESSAGE_INFO_PATTERN.groupindex)
+EMAIL_INFO_FIELDS = frozenset(name.rsplit('_', 1)[0] for name in EMAIL_INFO_PATTERN.groupindex)
+
+# Outermost {...} in a model reply, which may wrap its JSON in prose or fences
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+def parse_json_response(text: str) -> Optional[Dict]:
+    """Parse the JSON object in a model reply, or None if there isn't a valid one"""
+    match = JSON_OBJECT_PATTERN.search(text or '')
+    if not match:
+        return None
+    try:
+        result = json.loads(match.group(0))
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+def format_chat_summary(summary: Dict) -> str:
+    """Format one per-chat summary for the overview prompt"""
+    return f"Chat: {summary['chat_topic']}\n{summary['summary']}"
+
+def has_quote(query: str) -> bool:
+    """Cheap pre-check: quoted message content needs a quote character in the query"""
+    return '"' in query or "'" in query
+
+def scan_fields(pattern: re.Pattern, fields: frozenset, query: str, query_lower: str) -> Dict:
+    """Scan query_lower once with a fused pattern.
+    
+    Each field takes the first match of its preferred (lowest-numbered)
+    alternative that matched anywhere, as if the alternatives were searched
+    one after another in order.
+    """
+    # Values are sliced from the original query to keep their case, unless
+    # lowercasing changed the length (a few non-ASCII characters do)
+    source = query if len(query) == len(query_lower) else query_lower
+    found = {}  # field -> (alternative number, value)
+    preferred = 0
+    for match in pattern.finditer(query_lower):
+        field, number = match.lastgroup.rsplit('_', 1)
+        number = int(number)
+        if field in found and found[field][0] <= number:
+            continue
+        
+        start, end = match.span(match.lastgroup)
+        value = source[start:end]
+        found[field] = (number, value.strip() if field == 'recipient' else value)
+        if number == 0:
+            preferred += 1
+            # Nothing can replace a field's first alternative
+            if preferred == len(fields):
+                break
+    return {field: value for field, (number, value) in found.items()}
+
+# Static instructions that open each prompt. Keeping them as fixed,
+# unindented prefixes (with the per-request data appended after) gives the
+# model backend byte-identical prompt prefixes it can cache.
+TEAMS_TODAY_PROMPT_PREFIX = (
+    "Here are the user's Teams messages from today. Create a friendly, conversational summary.\n"
+    "Make it sound like you're a helpful assistant telling them about their day's messages.\n"
+    "Mention the most important ones and ask if they want to respond to any.\n\n"
+)
+
+EMAILS_TODAY_PROMPT_PREFIX = (
+    "Here are the user's emails from today. Create a helpful summary.\n"
+    "Highlight the most important ones, mention any that need urgent attention,\n"
+    "and ask if they want to respond to any.\n\n"
+)
+
+SEND_TEAMS_REVIEW_PROMPT_PREFIX = (
+    "The user wants to send the Teams message below. Please help them by:\n"
+    "1. Reviewing if the message is clear and professional\n"
+    "2. Suggesting any improvements\n"
+    "3. Asking if they want to add any context\n"
+    "4. Confirming they want to send it\n"
+    "Be conversational and helpful, like a personal assistant.\n\n"
+    "Message: "
+)
+
+TEAMS_BATCH_SUMMARY_PROMPT_PREFIX = (
+    "Below are the user's Teams chats from today, each starting with a \"### Chat <number>: <topic>\" line.\n"
+    "For each chat, give a brief summary of the main topics discussed, any decisions made and action items.\n"
+    "Then create a friendly overview of their Teams activity today.\n"
+    "Reply with only a JSON object of this form, with one entry per chat in the same order:\n"
+    '{"chats": [{"chat_topic": "<topic>", "summary": "<summary>"}], "overall_summary": "<overview>"}\n\n'
+)
+
+TEAMS_CHAT_SUMMARY_PROMPT_PREFIX = (
+    "Summarize the Teams chat conversation below. Provide a brief summary of:\n"
+    "1. Main topics discussed\n"
+    "2. Any decisions made\n"
+    "3. Action items\n\n"
+)
+
+TEAMS_OVERVIEW_PROMPT_PREFIX = (
+    "Create a friendly overview of the user's Teams activity today\n"
+    "from these summaries of their Teams chats:\n\n"
+)
+
+# Prompts with fields interleaved in the text are format_map templates;
+# PromptFields supplies defaults for any field the caller doesn't have
+SEND_EMAIL_REVIEW_PROMPT_TEMPLATE = (
+    "The user wants to send the email below. Please review and provide suggestions:\n"
+    "1. Is the tone appropriate?\n"
+    "2. Should they add CC recipients?\n"
+    "3. Any improvements to subject or content?\n"
+    "4. Do they need attachments?\n"
+    "5. Ask if they're ready to send\n"
+    "Be helpful and conversational.\n\n"
+    "To: {recipient}\n"
+    "Subject: {subject}\n"
+    "Body: {content}"
+)
+
+# Daily summary built by the quick-actions endpoints from the Teams and
+# email handler replies
+DAILY_SUMMARY_PROMPT_TEMPLATE = (
+    "Create a daily summary for the user:\n\n"
+    "Teams Activity:\n{teams}\n\n"
+    "Email Activity:\n{emails}\n\n"
+    "Provide a brief, friendly daily overview and ask what they'd like to focus on."
+)
+
+# context_type -> prompt template for generate_contextual_response
+CONTEXT_PROMPT_TEMPLATES = {
+    'teams_message_response': (
+        "The user wants to respond to this Teams message. "
+        "Help them craft a professional and appropriate response.\n\n"
+        "From: {sender}\n"
+        "Message: {content}\n\n"
+        "User's intended response: {query}"
+    ),
+    'email_response': (
+        "The user wants to respond to this email. "
+        "Help them write a professional email response.\n\n"
+        "From: {sender}\n"
+        "Subject: {subject}\n"
+        "Content: {content}\n\n"
+        "User's intended response: {query}"
+    ),
+    'meeting_preparation': (
+        "The user has an upcoming meeting. Help them prepare for this meeting.\n\n"
+        "Title: {title}\n"
+        "Attendees: {attendees}\n"
+        "Time: {time}\n\n"
+        "User query: {query}"
+    )
+}
+
+class PromptFields(dict):
+    """Values for a prompt template; missing fields fall back to a default"""
+    DEFAULTS = {'recipient': 'Not specified', 'sender': 'Unknown'}
+
+    def __missing__(self, key: str) -> str:
+        return self.DEFAULTS.get(key, '')
+
+EMAIL_SUMMARY_PROMPT_PREFIX = (
+    "Summarize the emails below for the user. Organize by:\n"
+    "1. Most urgent/important emails\n"
+    "2. Emails requiring response\n"
+    "3. FYI/informational emails\n"
+    "4. Overall themes/topics\n"
+    "Be conversational and helpful.\n\n"
+)
+
 class EnhancedAIService:
     """Enhanced AI service that integrates with Microsoft Graph for Teams and Outlook"""
     
     def __init__(self, access_token: str = None):
-        self.ai_service = GeminiService()
-        self.graph_service = MicrosoftGraphService()
-        if access_token:
-            self.graph_service.set_access_token(access_token)
+        # Both backing services are built on first use: plain AI queries never
+        # need Graph (and its MSAL client), Graph listings may never need Gemini
+        self.access_token = access_token
+
+    @cached_property
+    def ai_service(self) -> CachedAIService:
+        """Gemini client, created on first use"""
+        return CachedAIService(get_service())
+
+    @cached_property
+    def graph_service(self) -> MicrosoftGraphService:
+        """Microsoft Graph client for this token, created on first use"""
+        graph_service = MicrosoftGraphService()
+        if self.access_token:
+            graph_service.set_access_token(self.access_token)
+        return graph_service
 
     def process_user_query(self, query: str, user_context: Dict = None) -> Dict:
         """Process user query and determine if it needs Microsoft Graph integration"""
         
         query_lower = query.lower()
         
-        # Intent detection patterns
-        intent_patterns = {
-            'teams_messages_today': ['teams messages today', 'teams today', 'new messages teams', 'what\'s new in teams'],
-            'outlook_emails_today': ['emails today', 'new emails', 'outlook today', 'mail today'],
-            'send_teams_message': ['send teams message', 'message someone teams', 'teams send'],
-            'send_email': ['send email', 'email someone', 'compose email'],
-            'summarize_teams_chat': ['summarize teams', 'summarize chat', 'teams summary'],
-            'summarize_emails': ['summarize emails', 'email summary', 'summarize mail']
-        }
-        
-        detected_intent = None
-        for intent, patterns in intent_patterns.items():
-            if any(pattern in query_lower for pattern in patterns):
-                detected_intent = intent
-                break
+        detected_intent = detect_intent(query_lower)
+        if TRACK_INTENT_HITS:
+            record_intent_hit(detected_intent)
         
         if not detected_intent:
             # Regular AI query
@@ -45,29 +296,17 @@ class EnhancedAIService:
             }
         
         # Handle Microsoft Graph intents
-        return self._handle_microsoft_intent(detected_intent, query, user_context)
+        return self._handle_microsoft_intent(detected_intent, query, query_lower, user_context)
 
-    def _handle_microsoft_intent(self, intent: str, query: str, user_context: Dict = None) -> Dict:
+    def _handle_microsoft_intent(self, intent: str, query: str, query_lower: str = None, user_context: Dict = None) -> Dict:
         """Handle intents that require Microsoft Graph integration"""
         
+        handler = self.INTENT_HANDLERS.get(intent)
+        if handler is None:
+            return None
+        
         try:
-            if intent == 'teams_messages_today':
-                return self._handle_teams_messages_today(query)
-            
-            elif intent == 'outlook_emails_today':
-                return self._handle_emails_today(query)
-            
-            elif intent == 'send_teams_message':
-                return self._handle_send_teams_message(query)
-            
-            elif intent == 'send_email':
-                return self._handle_send_email(query)
-            
-            elif intent == 'summarize_teams_chat':
-                return self._handle_summarize_teams_chat(query)
-            
-            elif intent == 'summarize_emails':
-                return self._handle_summarize_emails(query)
+            return handler(self, query, query_lower or query.lower())
             
         except Exception as e:
             return {
@@ -76,7 +315,7 @@ class EnhancedAIService:
                 "requires_action": False
             }
 
-    def _handle_teams_messages_today(self, query: str) -> Dict:
+    def _handle_teams_messages_today(self, query: str, query_lower: str = None) -> Dict:
         """Handle request for today's Teams messages"""
         messages = self.graph_service.get_todays_teams_messages()
         
@@ -89,16 +328,10 @@ class EnhancedAIService:
             }
         
         # Use AI to create a friendly summary
-        formatted_messages = self.graph_service.summarize_chat_messages(messages[:10])  # Limit to 10 recent
-        
-        prompt = f"""
-        Here are the user's Teams messages from today. Create a friendly, conversational summary:
+        recent = messages[:10]  # Limit to 10 recent
+        formatted_messages = self.graph_service.summarize_chat_messages(recent)
         
-        {formatted_messages}
-        
-        Make it sound like you're a helpful assistant telling them about their day's messages.
-        Mention the most important ones and ask if they want to respond to any.
-        """
+        prompt = TEAMS_TODAY_PROMPT_PREFIX + formatted_messages
         
         ai_summary = self.ai_service.generate_response(prompt)
         
@@ -108,12 +341,12 @@ class EnhancedAIService:
             "requires_action": True,
             "actions": ["respond_to_message", "mark_as_read", "get_more_details"],
             "data": {
-                "messages": messages[:10],
+                "messages": recent,
                 "total_count": len(messages)
             }
         }
 
-    def _handle_emails_today(self, query: str) -> Dict:
+    def _handle_emails_today(self, query: str, query_lower: str = None) -> Dict:
         """Handle request for today's emails"""
         emails = self.graph_service.get_todays_emails()
         
@@ -126,16 +359,10 @@ class EnhancedAIService:
             }
         
         # Use AI to create a summary
-        formatted_emails = self.graph_service.format_emails_for_ai(emails[:10])
-        
-        prompt = f"""
-        Here are the user's emails from today. Create a helpful summary:
-        
-        {formatted_emails}
+        recent = emails[:10]
+        formatted_emails = self.graph_service.format_emails_for_ai(recent)
         
-        Highlight the most important ones, mention any that need urgent attention,
-        and ask if they want to respond to any.
-        """
+        prompt = EMAILS_TODAY_PROMPT_PREFIX + formatted_emails
         
         ai_summary = self.ai_service.generate_response(prompt)
         
@@ -145,15 +372,19 @@ class EnhancedAIService:
             "requires_action": True,
             "actions": ["reply_to_email", "compose_email", "mark_as_read"],
             "data": {
-                "emails": emails[:10],
+                "emails": recent,
                 "total_count": len(emails)
             }
         }
 
-    def _handle_send_teams_message(self, query: str) -> Dict:
+    def _handle_send_teams_message(self, query: str, query_lower: str = None) -> Dict:
         """Handle request to send a Teams message"""
-        # Extract message content and recipient info from query
-        message_info = self._extract_message_info(query, "teams")
+        # Extract message content and recipient info from query. Content is
+        # always quoted, so an unquoted query can skip the regex scan entirely.
+        if has_quote(query):
+            message_info = self._extract_message_info(query, query_lower or query.lower(), "teams")
+        else:
+            message_info = {}
         
         if not message_info.get('content'):
             return {
@@ -164,23 +395,14 @@ class EnhancedAIService:
                 "data": {}
             }
         
-        # Get user's chats to find the right recipient
-        chats = self.graph_service.get_my_chats()
-        
         # Use AI to help craft the message
-        prompt = f"""
-        The user wants to send this Teams message: "{message_info['content']}"
-        
-        Please help them by:
-        1. Reviewing if the message is clear and professional
-        2. Suggesting any improvements
-        3. Asking if they want to add any context
-        4. Confirming they want to send it
+        prompt = f"{SEND_TEAMS_REVIEW_PROMPT_PREFIX}\"{message_info['content']}\""
         
-        Be conversational and helpful, like a personal assistant.
-        """
-        
-        ai_response = self.ai_service.generate_response(prompt)
+        # Fetch the user's chats (to pick a recipient) while Gemini reviews the message
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            chats_future = executor.submit(self.graph_service.get_my_chats)
+            ai_response = self.ai_service.generate_response(prompt)
+            chats = chats_future.result()
         
         return {
             "type": "teams_send",
@@ -194,9 +416,13 @@ class EnhancedAIService:
             }
         }
 
-    def _handle_send_email(self, query: str) -> Dict:
+    def _handle_send_email(self, query: str, query_lower: str = None) -> Dict:
         """Handle request to send an email"""
-        email_info = self._extract_email_info(query)
+        # Body and subject are always quoted; without a quote there's nothing to review
+        if has_quote(query):
+            email_info = self._extract_email_info(query, query_lower or query.lower())
+        else:
+            email_info = {}
         
         if not email_info.get('content') or not email_info.get('subject'):
             return {
@@ -208,21 +434,7 @@ class EnhancedAIService:
             }
         
         # Use AI to review the email
-        prompt = f"""
-        The user wants to send this email:
-        To: {email_info.get('recipient', 'Not specified')}
-        Subject: {email_info.get('subject', '')}
-        Body: {email_info.get('content', '')}
-        
-        Please review and provide suggestions:
-        1. Is the tone appropriate?
-        2. Should they add CC recipients?
-        3. Any improvements to subject or content?
-        4. Do they need attachments?
-        5. Ask if they're ready to send
-        
-        Be helpful and conversational.
-        """
+        prompt = SEND_EMAIL_REVIEW_PROMPT_TEMPLATE.format_map(PromptFields(email_info))
         
         ai_response = self.ai_service.generate_response(prompt)
         
@@ -236,7 +448,7 @@ class EnhancedAIService:
             }
         }
 
-    def _handle_summarize_teams_chat(self, query: str) -> Dict:
+    def _handle_summarize_teams_chat(self, query: str, query_lower: str = None) -> Dict:
         """Handle request to summarize Teams chat"""
         # Get recent Teams messages
         messages = self.graph_service.get_todays_teams_messages()
@@ -252,50 +464,27 @@ class EnhancedAIService:
         # Group messages by chat
         chats_summary = {}
         for msg in messages:
-            chat_id = msg.get('chat_info', {}).get('chat_id')
-            topic = msg.get('chat_info', {}).get('topic', 'Unknown Chat')
-            
-            if chat_id not in chats_summary:
-                chats_summary[chat_id] = {
-                    'topic': topic,
+            chat_info = msg.get('chat_info') or {}
+            chat = chats_summary.get(chat_info.get('chat_id'))
+            if chat is None:
+                chat = chats_summary[chat_info.get('chat_id')] = {
+                    'topic': chat_info.get('topic', 'Unknown Chat'),
                     'messages': []
                 }
-            chats_summary[chat_id]['messages'].append(msg)
+            chat['messages'].append(msg)
         
-        # Summarize each chat
-        summaries = []
-        for chat_id, chat_data in chats_summary.items():
-            formatted_messages = self.graph_service.summarize_chat_messages(chat_data['messages'])
-            
-            prompt = f"""
-            Summarize this Teams chat conversation:
-            Chat: {chat_data['topic']}
-            
-            {formatted_messages}
+        # Summarize every chat and the overall day in one Gemini call
+        chats = list(chats_summary.values())
+        summaries, overall_summary = self._summarize_chats_batched(chats)
+        
+        if summaries is None:
+            # The reply wasn't usable JSON: summarize each chat concurrently, then overall
+            with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_WORKERS, len(chats))) as executor:
+                summaries = list(executor.map(self._summarize_chat, chats))
             
-            Provide a brief summary of:
-            1. Main topics discussed
-            2. Any decisions made
-            3. Action items
-            """
+            overall_prompt = TEAMS_OVERVIEW_PROMPT_PREFIX + "\n".join(format_chat_summary(s) for s in summaries)
             
-            summary = self.ai_service.generate_response(prompt)
-            summaries.append({
-                'chat_topic': chat_data['topic'],
-                'summary': summary,
-                'message_count': len(chat_data['messages'])
-            })
-        
-        # Create overall summary
-        overall_prompt = f"""
-        Here are summaries of the user's Teams chats today:
-        
-        {chr(10).join([f"Chat: {s['chat_topic']}\n{s['summary']}" for s in summaries])}
-        
-        Create a friendly overview of their Teams activity today.
-        """
-        
-        overall_summary = self.ai_service.generate_response(overall_prompt)
+            overall_summary = self.ai_service.generate_response(overall_prompt)
         
         return {
             "type": "teams_summary",
@@ -308,7 +497,48 @@ class EnhancedAIService:
             }
         }
 
-    def _handle_summarize_emails(self, query: str) -> Dict:
+    def _summarize_chats_batched(self, chats: List[Dict]) -> Tuple[Optional[List[Dict]], Optional[str]]:
+        """Summarize all chats plus an overview with a single Gemini call, or (None, None) on a bad reply"""
+        chat_sections = "\n\n".join(
+            f"### Chat {number}: {chat['topic']}\n{self.graph_service.summarize_chat_messages(chat['messages'])}"
+            for number, chat in enumerate(chats, 1)
+        )
+        
+        prompt = TEAMS_BATCH_SUMMARY_PROMPT_PREFIX + chat_sections
+        
+        result = parse_json_response(self.ai_service.generate_response(prompt))
+        if not result:
+            return None, None
+        
+        chat_results = result.get('chats')
+        overall_summary = result.get('overall_summary')
+        if not isinstance(chat_results, list) or len(chat_results) != len(chats) or not overall_summary:
+            return None, None
+        
+        summaries = [
+            {
+                'chat_topic': chat['topic'],
+                'summary': chat_result.get('summary', '') if isinstance(chat_result, dict) else str(chat_result),
+                'message_count': len(chat['messages'])
+            }
+            for chat, chat_result in zip(chats, chat_results)
+        ]
+        return summaries, str(overall_summary)
+
+    def _summarize_chat(self, chat_data: Dict) -> Dict:
+        """Summarize the messages of a single Teams chat"""
+        formatted_messages = self.graph_service.summarize_chat_messages(chat_data['messages'])
+        
+        prompt = f"{TEAMS_CHAT_SUMMARY_PROMPT_PREFIX}Chat: {chat_data['topic']}\n\n{formatted_messages}"
+        
+        summary = self.ai_service.generate_response(prompt)
+        return {
+            'chat_topic': chat_data['topic'],
+            'summary': summary,
+            'message_count': len(chat_data['messages'])
+        }
+
+    def _handle_summarize_emails(self, query: str, query_lower: str = None) -> Dict:
         """Handle request to summarize emails"""
         emails = self.graph_service.get_todays_emails()
         
@@ -320,21 +550,10 @@ class EnhancedAIService:
                 "data": {}
             }
         
-        formatted_emails = self.graph_service.format_emails_for_ai(emails[:15])
-        
-        prompt = f"""
-        Summarize these emails for the user:
-        
-        {formatted_emails}
+        recent = emails[:15]
+        formatted_emails = self.graph_service.format_emails_for_ai(recent)
         
-        Organize by:
-        1. Most urgent/important emails
-        2. Emails requiring response
-        3. FYI/informational emails
-        4. Overall themes/topics
-        
-        Be conversational and helpful.
-        """
+        prompt = EMAIL_SUMMARY_PROMPT_PREFIX + formatted_emails
         
         summary = self.ai_service.generate_response(prompt)
         
@@ -344,123 +563,39 @@ class EnhancedAIService:
             "requires_action": True,
             "actions": ["reply_to_email", "mark_important", "schedule_response"],
             "data": {
-                "emails": emails[:15],
+                "emails": recent,
                 "total_count": len(emails)
             }
         }
 
-    def _extract_message_info(self, query: str, platform: str) -> Dict:
+    # intent -> handler, looked up once per query instead of an if/elif chain
+    INTENT_HANDLERS = {
+        'teams_messages_today': _handle_teams_messages_today,
+        'outlook_emails_today': _handle_emails_today,
+        'send_teams_message': _handle_send_teams_message,
+        'send_email': _handle_send_email,
+        'summarize_teams_chat': _handle_summarize_teams_chat,
+        'summarize_emails': _handle_summarize_emails
+    }
+
+    def _extract_message_info(self, query: str, query_lower: str, platform: str) -> Dict:
         """Extract message information from user query"""
-        info = {}
-        
-        # Simple regex patterns to extract content
-        message_patterns = [
-            r'send\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
-            r'message\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
-            r'tell\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
-            r'say\s+["\']([^"\']+)["\']'
-        ]
-        
-        for pattern in message_patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
-            if match:
-                info['content'] = match.group(1)
-                break
-        
-        # Extract recipient info
-        recipient_patterns = [
-            r'(?:to|message)\s+([A-Za-z\s]+)(?:\s+that|\s+to|\s+about)',
-            r'(?:send|tell)\s+([A-Za-z\s]+)\s+that'
-        ]
-        
-        for pattern in recipient_patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
-            if match:
-                info['recipient'] = match.group(1).strip()
-                break
-        
-        return info
+        return scan_fields(MESSAGE_INFO_PATTERN, MESSAGE_INFO_FIELDS, query, query_lower)
 
-    def _extract_email_info(self, query: str) -> Dict:
+    def _extract_email_info(self, query: str, query_lower: str) -> Dict:
         """Extract email information from user query"""
-        info = {}
-        
-        # Extract email content
-        content_patterns = [
-            r'email\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
-            r'send\s+(?:an\s+)?email\s+["\']([^"\']+)["\']',
-            r'compose\s+["\']([^"\']+)["\']'
-        ]
-        
-        for pattern in content_patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
-            if match:
-                info['content'] = match.group(1)
-                break
-        
-        # Extract subject
-        subject_patterns = [
-            r'subject\s+["\']([^"\']+)["\']',
-            r'about\s+["\']([^"\']+)["\']'
-        ]
-        
-        for pattern in subject_patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
-            if match:
-                info['subject'] = match.group(1)
-                break
-        
-        # Extract recipient
-        recipient_patterns = [
-            r'(?:to|email)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
-            r'(?:to|email)\s+([A-Za-z\s]+)(?:\s+that|\s+to|\s+about)'
-        ]
-        
-        for pattern in recipient_patterns:
-            match = re.search(pattern, query, re.IGNORECASE)
-            if match:
-                info['recipient'] = match.group(1).strip()
-                break
-        
-        return info
+        return scan_fields(EMAIL_INFO_PATTERN, EMAIL_INFO_FIELDS, query, query_lower)
 
     def generate_contextual_response(self, query: str, context_type: str, context_data: Dict) -> str:
         """Generate contextual AI responses based on Microsoft Graph data"""
         
-        if context_type == "teams_message_response":
-            prompt = f"""
-            The user wants to respond to this Teams message:
-            From: {context_data.get('sender', 'Unknown')}
-            Message: {context_data.get('content', '')}
-            
-            User's intended response: {query}
-            
-            Help them craft a professional and appropriate response.
-            """
-        
-        elif context_type == "email_response":
-            prompt = f"""
-            The user wants to respond to this email:
-            From: {context_data.get('sender', 'Unknown')}
-            Subject: {context_data.get('subject', '')}
-            Content: {context_data.get('content', '')}
-            
-            User's intended response: {query}
-            
-            Help them write a professional email response.
-            """
-        
-        elif context_type == "meeting_preparation":
-            prompt = f"""
-            The user has an upcoming meeting:
-            Title: {context_data.get('title', '')}
-            Attendees: {', '.join(context_data.get('attendees', []))}
-            Time: {context_data.get('time', '')}
-            
-            User query: {query}
-            
-            Help them prepare for this meeting.
-            """
+        template = CONTEXT_PROMPT_TEMPLATES.get(context_type)
+        
+        if template:
+            fields = PromptFields(context_data, query=query)
+            if context_type == "meeting_preparation":
+                fields['attendees'] = ', '.join(context_data.get('attendees', []))
+            prompt = template.format_map(fields)
         
         else:
             prompt = query
@@ -469,4 +604,11 @@ class EnhancedAIService:
 
     def set_access_token(self, token: str):
         """Set Microsoft Graph access token"""
-        self.graph_service.set_access_token(token)
\ No newline at end of file
+        self.access_token = token
+        if 'graph_service' in self.__dict__:
+            self.graph_service.set_access_token(token)
+
+@lru_cache(maxsize=256)
+def get_enhanced_ai_service(access_token: str = None) -> EnhancedAIService:
+    """Return the shared EnhancedAIService for an access token"""
+    return EnhancedAIService(access_token)
@@ -1,6 +1,18 @@
 import os
+import re
+import functools
+import random
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
+from typing import Iterator, Optional
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import threading
+import time
 import logging
 
 # Set up logging
@@ -9,6 +21,177 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Fixed task instructions given to the summary and code models as system
+# instructions, so each request only sends its own text and the instruction
+# prefix is identical (and cacheable server-side) across calls
+SUMMARY_SYSTEM_INSTRUCTION = (
+    "You summarize documents. Reply with only the summary, "
+    "at the length the user asks for (short, medium or long)."
+)
+CODE_SYSTEM_INSTRUCTION = (
+    "Generate clean, well-commented code for the user's request. "
+    "Please provide only the code with brief comments."
+)
+
+# get_smart_response routing keywords. They match anywhere in the prompt,
+# ignoring case; each set is one compiled alternation, so routing is a single
+# C-level scan per set rather than a Python loop of substring tests
+SUMMARY_KEYWORD_PATTERN = re.compile('|'.join(map(re.escape, (
+    'summarize', 'summary', 'summarise', 'brief', 'overview', 'key points'
+))), re.IGNORECASE)
+CODE_KEYWORD_PATTERN = re.compile('|'.join(map(re.escape, (
+    'code', 'python', 'function', 'class', 'import', 'def', 'print', 'variable', 'javascript', 'html', 'css'
+))), re.IGNORECASE)
+
+# Exact-match response cache used by CachedAIService: entries kept, and
+# seconds before a response is regenerated so summaries follow fresh data
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 120
+
+# Low-temperature results (summaries, code) depend only on their input, so
+# GeminiService keeps them for an hour
+DETERMINISTIC_CACHE_TTL = 3600
+
+# Documents longer than this are summarized in overlapping chunks in
+# parallel (at most SUMMARY_MAX_WORKERS calls at once), then combined
+SUMMARY_CHUNK_CHARS = 12000
+SUMMARY_CHUNK_OVERLAP = 200
+SUMMARY_MAX_WORKERS = 8
+
+# Chat prompts (history plus the new message) are cut to this many input
+# tokens, dropping the oldest turns first. Prompts whose length estimate at
+# CHARS_PER_TOKEN is at most half the budget are sent without counting
+CHAT_PROMPT_TOKEN_BUDGET = 7800
+CHARS_PER_TOKEN = 4
+
+# Output token budget per summary length
+SUMMARY_TOKEN_LIMITS = {
+    "short": 100,
+    "medium": 200,
+    "long": 400
+}
+
+# At most this many Gemini requests are in flight across all GeminiService
+# instances; rate-limit and availability errors are retried with jittered
+# exponential backoff (GEMINI_RETRY_BASE_DELAY, doubling per attempt)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MAX_ATTEMPTS = 4
+GEMINI_RETRY_BASE_DELAY = 0.25
+GEMINI_RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded
+)
+gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+
+# More permissive safety settings used by generate_with_safety_settings
+PERMISSIVE_SAFETY_SETTINGS = tuple(
+    {"category": category, "threshold": "BLOCK_ONLY_HIGH"}
+    for category in (
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT"
+    )
+)
+
+# Replies for candidates Gemini stopped early, by finish reason. MAX_TOKENS is
+# not a block: a reply cut off at max_output_tokens is returned as far as it got
+FinishReason = genai.protos.Candidate.FinishReason
+BLOCKED_RESPONSE_MESSAGES = {
+    FinishReason.SAFETY: "I apologize, but I can't provide a response to that request due to safety guidelines. Please try rephrasing your question.",
+    FinishReason.RECITATION: "I can't provide that response as it may contain copyrighted content. Please try asking in a different way.",
+    FinishReason.OTHER: "I'm unable to provide a response to that request. Please try rephrasing your question."
+}
+NO_CONTENT_MESSAGE = "I wasn't able to generate a proper response. Please try rephrasing your question."
+
+# Replies generate_text returns on transient failures; never cached
+TRANSIENT_ERROR_PREFIXES = ("Sorry,", "Authentication error", "Invalid request")
+
+# Canned replies for blocked or empty candidates; never cached either, so one
+# bad generation isn't repeated for the rest of the entry's TTL
+CANNED_RESPONSES = frozenset(BLOCKED_RESPONSE_MESSAGES.values()) | {NO_CONTENT_MESSAGE}
+
+# Replies for Gemini API errors, chosen by exception type in gemini_errors
+QUOTA_ERROR_MESSAGE = "Sorry, I'm currently experiencing high demand. Please try again in a moment."
+AUTH_ERROR_MESSAGE = "Authentication error. Please check the API configuration."
+INVALID_REQUEST_MESSAGE = "Invalid request. Please try rephrasing your question."
+
+def gemini_errors(failure_message: str):
+    """Turn Gemini API errors raised by a GeminiService method into user-facing replies.
+    
+    Errors are told apart by their google.api_core exception type; anything
+    else is logged and reported as "<failure_message>: <error>".
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except google_exceptions.ResourceExhausted:
+                logger.error("Rate limit or quota exceeded")
+                return QUOTA_ERROR_MESSAGE
+            except (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied):
+                logger.error("Authentication failed - check your API key")
+                return AUTH_ERROR_MESSAGE
+            except google_exceptions.InvalidArgument as e:
+                # An invalid API key is reported as INVALID_ARGUMENT too
+                if "api key" in e.message.lower():
+                    logger.error("Authentication failed - check your API key")
+                    return AUTH_ERROR_MESSAGE
+                logger.error(f"Invalid request: {str(e)}")
+                return INVALID_REQUEST_MESSAGE
+            except Exception as e:
+                logger.error(f"Error in {method.__name__}: {str(e)}")
+                return f"{failure_message}: {str(e)}"
+        return wrapper
+    return decorator
+
+@lru_cache(maxsize=32)
+def generation_config(temperature: float, top_p: float = 1, top_k: int = 40, max_output_tokens: Optional[int] = None):
+    """Build a GenerationConfig, reusing one instance per distinct setting"""
+    return genai.types.GenerationConfig(
+        max_output_tokens=max_output_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k
+    )
+
+class ResponseCache:
+    """Thread-safe LRU of generated responses that expire after ttl seconds"""
+    
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, response)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Hash everything that determines a response into a cache key"""
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the unexpired response for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+    
+    def put(self, key: str, response: str):
+        """Store a response unless it is empty, a transient error or a canned reply"""
+        if not response or response.startswith(TRANSIENT_ERROR_PREFIXES) or response in CANNED_RESPONSES:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
 class GeminiService:
     def __init__(self):
         """Initialize Gemini service with API key from environment"""
@@ -20,257 +203,266 @@ class GeminiService:
         genai.configure(api_key=self.api_key)
         
         # Initialize the model (using Gemini 2.5 Flash - best price-performance)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+        self.summary_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SUMMARY_SYSTEM_INSTRUCTION)
+        self.code_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=CODE_SYSTEM_INSTRUCTION)
+        
+        # Repeated summary/code requests are answered without calling Gemini
+        self._response_cache = ResponseCache(ttl=DETERMINISTIC_CACHE_TTL)
         
         logger.info("Gemini service initialized successfully")
 
+    def _generate_content(self, contents, model=None, **kwargs):
+        """Call Gemini with bounded concurrency, retrying rate-limit and availability errors"""
+        model = model or self.model
+        for attempt in range(GEMINI_MAX_ATTEMPTS):
+            try:
+                with gemini_slots:
+                    return model.generate_content(contents, **kwargs)
+            except GEMINI_RETRYABLE_ERRORS as e:
+                if attempt == GEMINI_MAX_ATTEMPTS - 1:
+                    raise
+                # Back off outside the semaphore so waiting doesn't hold a slot
+                delay = GEMINI_RETRY_BASE_DELAY * 2 ** attempt * (1 + random.random())
+                logger.warning(f"Gemini request failed ({str(e)}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _invoke(self, contents, model=None, safety_settings=None, **config) -> str:
+        """Generate with the given generation_config() settings and return the reply text"""
+        kwargs = {}
+        if config:
+            kwargs['generation_config'] = generation_config(**config)
+        if safety_settings:
+            kwargs['safety_settings'] = safety_settings
+        
+        return self._handle_response(self._generate_content(contents, model=model, **kwargs))
+
     def _handle_response(self, response) -> str:
         """Handle Gemini response and check for safety blocks or other issues"""
         try:
-            # Check if response was blocked
-            if hasattr(response, 'candidates') and response.candidates:
+            # Common case first: one candidate that finished normally with text
+            try:
                 candidate = response.candidates[0]
+            except (AttributeError, IndexError, TypeError):
+                candidate = None
+            
+            if candidate is not None:
+                finish_reason = getattr(candidate, 'finish_reason', None)
+                blocked_message = BLOCKED_RESPONSE_MESSAGES.get(finish_reason)
+                if blocked_message:
+                    logger.warning(f"Response blocked (finish reason {finish_reason})")
+                    return blocked_message
+                if finish_reason == FinishReason.MAX_TOKENS:
+                    logger.warning("Response reached max_output_tokens, returning it truncated")
                 
-                # Check finish reason
-                if hasattr(candidate, 'finish_reason'):
-                    finish_reason = candidate.finish_reason
-                    
-                    if finish_reason == 2:  # SAFETY
-                        logger.warning("Response blocked by safety filters")
-                        return "I apologize, but I can't provide a response to that request due to safety guidelines. Please try rephrasing your question."
-                    if finish_reason == 3:  # RECITATION
-                        logger.warning("Response blocked due to recitation")
-                        return "I can't provide that response as it may contain copyrighted content. Please try asking in a different way."
-                    elif finish_reason == 4:  # OTHER
-                        logger.warning("Response blocked for other reasons")
-                        return "I'm unable to provide a response to that request. Please try rephrasing your question."
-                
-                # Check if there's actual content
-                if hasattr(candidate, 'content') and candidate.content and hasattr(candidate.content, 'parts'):
-                    if candidate.content.parts:
-                        return candidate.content.parts[0].text.strip()
+                try:
+                    return candidate.content.parts[0].text.strip()
+                except (AttributeError, IndexError):
+                    pass
             
-            # Fallback: try the .text accessor with error handling
-            if hasattr(response, 'text'):
+            # Fallback: the .text accessor
+            try:
                 return response.text.strip()
-            
-            # If we get here, there's no valid content
-            logger.warning("No valid content in response")
-            return "I wasn't able to generate a proper response. Please try rephrasing your question."
+            except AttributeError:
+                logger.warning("No valid content in response")
+                return NO_CONTENT_MESSAGE
             
         except Exception as e:
             logger.error(f"Error handling response: {str(e)}")
             return f"Sorry, I encountered an error processing the response: {str(e)}"
 
+    def generate_response(self, prompt: str) -> str:
+        """Generate a free-form response (the entry point EnhancedAIService uses)"""
+        return self.generate_text(prompt)
+
+    @gemini_errors("Sorry, I encountered an error")
     def generate_text(self, prompt: str, max_tokens: int = 150) -> str:
         """Generate text using Gemini API"""
         logger.info(f"Generating text for prompt: {prompt[:50]}...")
         
-        try:
-            # Configure generation settings
-            generation_config = genai.types.GenerationConfig(
-                # max_output_tokens=max_tokens,
-                temperature=0.7,
-                top_p=1,
-                top_k=40
-            )
-            
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            generated_text = self._handle_response(response)
-            logger.info(f"Generated text: {generated_text[:100]}...")
-            return generated_text
-            
-        except Exception as e:
-            error_message = str(e).lower()
-            
-            if "quota" in error_message or "limit" in error_message:
-                logger.error("Rate limit or quota exceeded")
-                return "Sorry, I'm currently experiencing high demand. Please try again in a moment."
-            elif "api" in error_message and "key" in error_message:
-                logger.error("Authentication failed - check your API key")
-                return "Authentication error. Please check the API configuration."
-            elif "invalid" in error_message:
-                logger.error(f"Invalid request: {str(e)}")
-                return "Invalid request. Please try rephrasing your question."
-            else:
-                logger.error(f"Unexpected error: {str(e)}")
-                return f"Sorry, I encountered an error: {str(e)}"
+        # max_tokens is deliberately not applied as max_output_tokens
+        generated_text = self._invoke(prompt, temperature=0.7)
+        logger.info(f"Generated text: {generated_text[:100]}...")
+        return generated_text
 
     # Replace the generate_chat_response method in your GeminiService class with this:
 
+    @gemini_errors("I encountered an error processing your request")
     def generate_chat_response(self, prompt: str, conversation_history: list = None) -> str:
         """Generate conversational response with context"""
         logger.info(f"Generating chat response for: {prompt[:50]}...")
         
+        # Chat replies use Gemini's default generation and safety settings
+        
+        # Try with conversation history first, but with better formatting
+        if conversation_history and len(conversation_history) > 0:
+            try:
+                full_prompt = self._build_chat_prompt(prompt, conversation_history)
+                
+                if full_prompt != prompt:
+                    chat_response = self._invoke(full_prompt)
+                    
+                    # If response looks good, return it
+                    if not ("safety" in chat_response.lower() or "can't provide" in chat_response.lower()):
+                        logger.info(f"Chat response with history: {chat_response[:100]}...")
+                        return chat_response
+                        
+            except Exception as e:
+                logger.warning(f"Failed to generate with history context: {str(e)}")
+        
+        # Fallback: Try without conversation history
+        logger.info("Trying without conversation history...")
+        chat_response = self._invoke(prompt)
+        logger.info(f"Chat response without history: {chat_response[:100]}...")
+        return chat_response
+
+    def _build_chat_prompt(self, prompt: str, conversation_history: list = None) -> str:
+        """Prefix the prompt with as many recent conversation turns as fit CHAT_PROMPT_TOKEN_BUDGET"""
+        if not conversation_history:
+            return prompt
+        
+        context_parts = []
+        for msg in conversation_history:
+            role = "User" if msg.get('role') == 'user' else "Assistant"
+            content = msg.get('content', '').strip()
+            if content:
+                context_parts.append(f"{role}: {content}")
+        
+        if not context_parts:
+            return prompt
+        
+        # Add current prompt
+        context_parts.append(f"User: {prompt}")
+        
+        full_prompt = "\n\n".join(context_parts)
+        if len(full_prompt) <= CHAT_PROMPT_TOKEN_BUDGET * CHARS_PER_TOKEN // 2:
+            return full_prompt
+        
+        # Binary search for the fewest dropped turns that fit; the current prompt is always kept
+        low, high = 0, len(context_parts) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._count_tokens("\n\n".join(context_parts[middle:])) <= CHAT_PROMPT_TOKEN_BUDGET:
+                high = middle
+            else:
+                low = middle + 1
+        
+        if low:
+            logger.info(f"Dropped {low} conversation turns to fit the token budget")
+        return "\n\n".join(context_parts[low:])
+
+    def _count_tokens(self, text: str) -> int:
+        """Count text's tokens with Gemini, estimating from its length if that fails"""
+        try:
+            return self.model.count_tokens(text).total_tokens
+        except Exception as e:
+            logger.warning(f"Token count failed ({str(e)}), estimating")
+            return len(text) // CHARS_PER_TOKEN
+
+    def stream_chat_response(self, prompt: str, conversation_history: list = None) -> Iterator[str]:
+        """Generate a conversational response, yielding text as Gemini produces it"""
+        logger.info(f"Streaming chat response for: {prompt[:50]}...")
+        
         try:
-            # First try without conversation history to avoid safety filter issues
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=200,
-                temperature=0.8,
-                top_p=1,
-                top_k=40
+            response = self._generate_content(
+                self._build_chat_prompt(prompt, conversation_history),
+                stream=True
             )
             
-            # More permissive safety settings
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH", 
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                }
-            ]
-            
-            # Try with conversation history first, but with better formatting
-            if conversation_history and len(conversation_history) > 0:
+            for chunk in response:
+                # A chunk stopped for safety or recitation ends the stream with the usual reply
                 try:
-                    # Limit to last 6 messages and format more naturally
-                    recent_history = conversation_history[-6:] if len(conversation_history) > 6 else conversation_history
-                    
-                    # Build a cleaner context
-                    context_parts = []
-                    for msg in recent_history:
-                        role = "User" if msg.get('role') == 'user' else "Assistant"
-                        content = msg.get('content', '').strip()
-                        if content and len(content) < 500:  # Skip very long messages
-                            context_parts.append(f"{role}: {content}")
+                    finish_reason = chunk.candidates[0].finish_reason
+                except (AttributeError, IndexError, TypeError):
+                    finish_reason = None
+                blocked_message = BLOCKED_RESPONSE_MESSAGES.get(finish_reason)
+                if blocked_message:
+                    logger.warning(f"Streamed response blocked (finish reason {finish_reason})")
+                    yield blocked_message
+                    return
+                
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # No text parts: the stream was stopped by a safety or recitation block
+                    logger.warning("Streamed response was blocked")
+                    yield BLOCKED_RESPONSE_MESSAGES[FinishReason.SAFETY]
+                    return
+                if text:
+                    yield text
                     
-                    if context_parts:
-                        # Add current prompt
-                        context_parts.append(f"User: {prompt}")
-                        full_prompt = "\n\n".join(context_parts)
-                        
-                        response = self.model.generate_content(
-                            full_prompt
-                            # ,
-                            # generation_config=generation_config,
-                            # safety_settings=safety_settings
-                        )
-                        
-                        chat_response = self._handle_response(response)
-                        
-                        # If response looks good, return it
-                        if not ("safety" in chat_response.lower() or "can't provide" in chat_response.lower()):
-                            logger.info(f"Chat response with history: {chat_response[:100]}...")
-                            return chat_response
-                            
-                except Exception as e:
-                    logger.warning(f"Failed to generate with history context: {str(e)}")
-            
-            # Fallback: Try without conversation history
-            logger.info("Trying without conversation history...")
-            response = self.model.generate_content(
-                prompt
-                # ,
-                # generation_config=generation_config,
-                # safety_settings=safety_settings
-            )
-            
-            chat_response = self._handle_response(response)
-            logger.info(f"Chat response without history: {chat_response[:100]}...")
-            return chat_response
-            
         except Exception as e:
-            logger.error(f"Error in chat response: {str(e)}")
-            return f"I encountered an error processing your request: {str(e)}"
+            logger.error(f"Error in streamed chat response: {str(e)}")
+            yield f"I encountered an error processing your request: {str(e)}"
 
+    @gemini_errors("Sorry, I couldn't summarize the document")
     def summarize_document(self, text: str, summary_length: str = "medium") -> str:
         """Summarize a document"""
         logger.info(f"Summarizing document of length: {len(text)} characters")
         
-        # Determine max tokens based on summary length
-        token_limits = {
-            "short": 100,
-            "medium": 200,
-            "long": 400
-        }
-        max_tokens = token_limits.get(summary_length, 200)
+        cache_key = ResponseCache.make_key(method="summarize_document", text=text, length=summary_length)
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Summary cache hit")
+            return cached
         
-        try:
-            prompt = f"""Please provide a {summary_length} summary of the following text:
+        if len(text) <= SUMMARY_CHUNK_CHARS:
+            summary = self._summarize_text(text, summary_length)
+        else:
+            # Map: summarize the chunks concurrently; reduce: summarize their summaries
+            chunks = self._split_document(text)
+            logger.info(f"Summarizing {len(chunks)} chunks in parallel")
+            with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_WORKERS, len(chunks))) as executor:
+                chunk_summaries = list(executor.map(self._summarize_text, chunks))
+            summary = self._summarize_text("\n\n".join(chunk_summaries), summary_length)
+        
+        logger.info(f"Summary generated: {len(summary)} characters")
+        self._response_cache.put(cache_key, summary)
+        return summary
 
-{text}
+    def _summarize_text(self, text: str, summary_length: str = "medium") -> str:
+        """Make one Gemini summarization call"""
+        return self._invoke(
+            f"{text}\n\nSummary length: {summary_length}",
+            model=self.summary_model,
+            max_output_tokens=SUMMARY_TOKEN_LIMITS.get(summary_length, 200),
+            temperature=0.3,  # Lower temperature for more focused summaries
+            top_k=20
+        )
 
-Summary:"""
-            
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=max_tokens,
-                temperature=0.3,  # Lower temperature for more focused summaries
-                top_p=1,
-                top_k=20
-            )
-            
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            summary = self._handle_response(response)
-            logger.info(f"Summary generated: {len(summary)} characters")
-            return summary
-            
-        except Exception as e:
-            logger.error(f"Error in document summarization: {str(e)}")
-            return f"Sorry, I couldn't summarize the document: {str(e)}"
+    def _split_document(self, text: str) -> list:
+        """Split text into SUMMARY_CHUNK_CHARS windows that overlap by SUMMARY_CHUNK_OVERLAP"""
+        step = SUMMARY_CHUNK_CHARS - SUMMARY_CHUNK_OVERLAP
+        return [text[start:start + SUMMARY_CHUNK_CHARS] for start in range(0, len(text) - SUMMARY_CHUNK_OVERLAP, step)]
 
+    @gemini_errors("Sorry, I couldn't generate the code")
     def generate_code(self, prompt: str) -> str:
         """Generate code based on prompt"""
         logger.info(f"Generating code for: {prompt[:50]}...")
         
-        try:
-            code_prompt = f"""Generate clean, well-commented code for the following request:
-
-{prompt}
-
-Please provide only the code with brief comments:"""
-            
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=300,
-                temperature=0.2,  # Low temperature for more deterministic code
-                top_p=1,
-                top_k=20
-            )
-            
-            response = self.model.generate_content(
-                code_prompt,
-                generation_config=generation_config
-            )
-            
-            code = self._handle_response(response)
-            logger.info(f"Code generated successfully")
-            return code
-            
-        except Exception as e:
-            logger.error(f"Error in code generation: {str(e)}")
-            return f"Sorry, I couldn't generate the code: {str(e)}"
+        cache_key = ResponseCache.make_key(method="generate_code", prompt=prompt)
+        cached = self._response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Code cache hit")
+            return cached
+        
+        code = self._invoke(
+            prompt,
+            model=self.code_model,
+            max_output_tokens=300,
+            temperature=0.2,  # Low temperature for more deterministic code
+            top_k=20
+        )
+        logger.info(f"Code generated successfully")
+        self._response_cache.put(cache_key, code)
+        return code
 
     def get_smart_response(self, prompt: str, conversation_history: list = None) -> str:
         """Smart router that chooses the best response method"""
-        prompt_lower = prompt.lower()
-        
-        # Check for code-related requests
-        code_keywords = ['code', 'python', 'function', 'class', 'import', 'def', 'print', 'variable', 'javascript', 'html', 'css']
-        
-        # Check for summarization requests
-        summary_keywords = ['summarize', 'summary', 'summarise', 'brief', 'overview', 'key points']
-        
-        if any(keyword in prompt_lower for keyword in summary_keywords):
+        # Summarization requests take precedence over code requests
+        if SUMMARY_KEYWORD_PATTERN.search(prompt):
             return self.generate_chat_response(f"Please provide a summary: {prompt}", conversation_history)
-        elif any(keyword in prompt_lower for keyword in code_keywords):
+        elif CODE_KEYWORD_PATTERN.search(prompt):
             return self.generate_code(prompt)
         else:
             return self.generate_chat_response(prompt, conversation_history)
@@ -279,52 +471,19 @@ Please provide only the code with brief comments:"""
         """Main method that your routes should call"""
         return self.get_smart_response(query)
 
+    @gemini_errors("Sorry, I encountered an error")
     def generate_with_safety_settings(self, prompt: str, max_tokens: int = 150) -> str:
         """Generate text with custom safety settings (more permissive)"""
         logger.info(f"Generating with custom safety settings for: {prompt[:50]}...")
         
-        try:
-            # Configure more permissive safety settings
-            safety_settings = [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_ONLY_HIGH"
-                }
-            ]
-            
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=max_tokens,
-                temperature=0.7,
-                top_p=1,
-                top_k=40
-            )
-            
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
-            
-            generated_text = self._handle_response(response)
-            # generated_text = response
-            logger.info(f"Generated text with custom safety: {generated_text[:100]}...")
-            return generated_text
-            
-        except Exception as e:
-            logger.error(f"Error with custom safety settings: {str(e)}")
-            return f"Sorry, I encountered an error: {str(e)}"
+        generated_text = self._invoke(
+            prompt,
+            safety_settings=PERMISSIVE_SAFETY_SETTINGS,
+            max_output_tokens=max_tokens,
+            temperature=0.7
+        )
+        logger.info(f"Generated text with custom safety: {generated_text[:100]}...")
+        return generated_text
 
     def retry_with_modified_prompt(self, original_prompt: str) -> str:
         """Retry with a modified prompt if original was blocked"""
@@ -340,41 +499,62 @@ Please focus on factual information and helpful insights."""
         return self.generate_with_safety_settings(modified_prompt)
 
 
-# Initialize the service
-try:
-    ai_service = GeminiService()
-    
-    # Main functions for backwards compatibility with your existing code
-    def generate_text(prompt: str) -> str:
-        return ai_service.generate_text(prompt)
+class CachedAIService:
+    """Wraps a GeminiService and reuses responses to identical prompts.
     
-    def generate_chat_response(prompt: str) -> str:
-        return ai_service.generate_chat_response(prompt)
+    Only generate_response is cached; every other attribute is passed
+    through to the wrapped service.
+    """
     
-    def summarize_document(text: str) -> str:
-        return ai_service.summarize_document(text)
+    def __init__(self, service: GeminiService, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.service = service
+        self._cache = ResponseCache(maxsize, ttl)
     
-    def generate_code(prompt: str) -> str:
-        return ai_service.generate_code(prompt)
+    def __getattr__(self, name):
+        return getattr(self.service, name)
     
-    def get_answer(query: str) -> str:
-        return ai_service.get_answer(query)
+    def generate_response(self, prompt: str) -> str:
+        """Return a cached response for this exact prompt, generating it on a miss"""
+        key = ResponseCache.make_key(prompt=prompt)
         
-except Exception as e:
-    logger.error(f"Failed to initialize Gemini service: {str(e)}")
-    
-    # Fallback functions if Gemini fails
-    def generate_text(prompt: str) -> str:
-        return "Gemini service unavailable. Please check your API key."
-    
-    def generate_chat_response(prompt: str) -> str:
-        return "Gemini service unavailable. Please check your API key."
-    
-    def summarize_document(text: str) -> str:
-        return "Gemini service unavailable. Please check your API key."
-    
-    def generate_code(prompt: str) -> str:
-        return "Gemini service unavailable. Please check your API key."
-    
-    def get_answer(query: str) -> str:
-        return "Gemini service unavailable. Please check your API key."
\ No newline at end of file
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.info("Response cache hit")
+            return cached
+        
+        response = self.service.generate_response(prompt)
+        self._cache.put(key, response)
+        return response
+
+
+# Reply of the module-level helpers when no GeminiService can be built
+SERVICE_UNAVAILABLE_MESSAGE = "Gemini service unavailable. Please check your API key."
+
+@lru_cache(maxsize=1)
+def get_service() -> GeminiService:
+    """Build the shared GeminiService on first use rather than at import"""
+    return GeminiService()
+
+def _call_service(method: str, *args) -> str:
+    try:
+        service = get_service()
+    except Exception as e:
+        logger.error(f"Failed to initialize Gemini service: {str(e)}")
+        return SERVICE_UNAVAILABLE_MESSAGE
+    return getattr(service, method)(*args)
+
+# Main functions for backwards compatibility with your existing code
+def generate_text(prompt: str) -> str:
+    return _call_service('generate_text', prompt)
+
+def generate_chat_response(prompt: str) -> str:
+    return _call_service('generate_chat_response', prompt)
+
+def summarize_document(text: str) -> str:
+    return _call_service('summarize_document', text)
+
+def generate_code(prompt: str) -> str:
+    return _call_service('generate_code', prompt)
+
+def get_answer(query: str) -> str:
+    return _call_service('get_answer', query)
@@ -1,8 +1,17 @@
 import os
 from dotenv import load_dotenv
-from transformers import pipeline
+import torch
+from transformers import pipeline, TextIteratorStreamer
+from openai import OpenAI
 import logging
 import re
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from itertools import groupby
+from typing import Iterator
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,37 +19,175 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Initialize the pipeline with GPT-Neo (you can change this to other models)
-# pipe = pipeline("text-generation", model="EleutherAI/gpt-neo-2.7B")
-# pipe = pipeline("text-generation", model="EleutherAI/gpt-neo-1.3B")
-# pipe = pipeline("text-generation", model="pszemraj/led-large-book-summary")
-pipe = pipeline("text-generation", model="microsoft/Phi-3-mini-4k-instruct")
+# Text-generation model (you can change this to other models)
+# HF_MODEL = "EleutherAI/gpt-neo-2.7B"
+# HF_MODEL = "EleutherAI/gpt-neo-1.3B"
+# HF_MODEL = "pszemraj/led-large-book-summary"
+HF_MODEL = "microsoft/Phi-3-mini-4k-instruct"
+
+# Base URL of an OpenAI-compatible server hosting HF_MODEL, e.g. vLLM's
+# "http://localhost:8001/v1". When set, generation goes there (where
+# concurrent requests are continuously batched) instead of the local pipeline.
+HF_INFERENCE_URL = os.getenv("HF_INFERENCE_URL")
+
+# Local generations arriving within BATCH_WINDOW_MS of each other are run as
+# one batched pipeline call per kind of request (at most BATCH_MAX_SIZE each)
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "10"))
+BATCH_MAX_SIZE = 16
+
+@lru_cache(maxsize=1)
+def get_pipe():
+    """Load the text-generation pipeline on first use rather than at import"""
+    # Half precision on GPU halves the weight bytes read per generated token
+    if torch.cuda.is_available():
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    else:
+        dtype = torch.float32
+    
+    logger.info(f"Loading {HF_MODEL} ({dtype})")
+    pipe = pipeline("text-generation", model=HF_MODEL, torch_dtype=dtype, device_map="auto")
+    
+    # Batched prompts are padded on the left so every row ends where generation starts
+    if pipe.tokenizer.pad_token is None:
+        pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+    pipe.tokenizer.padding_side = "left"
+    return pipe
+
+class BatchScheduler:
+    """Collects concurrent local generations and runs them as batched pipeline calls.
+    
+    Requests are binned by kind (each generate_* function has its own fixed
+    settings and output length), so sequences in a batch finish in a similar
+    number of steps and little work is spent on padding.
+    """
+    
+    def __init__(self, window: float = BATCH_WINDOW_MS / 1000, max_size: int = BATCH_MAX_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+    
+    def submit(self, bin_key: str, prompt: str, kwargs: dict) -> list:
+        """Queue one generation and wait for its pipeline result"""
+        future = Future()
+        self._queue.put((bin_key, prompt, kwargs, future))
+        
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="hf-batcher", daemon=True)
+                self._worker.start()
+        
+        return future.result()
+    
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            bins = {}
+            for request in pending:
+                bins.setdefault(request[0], []).append(request)
+            for requests in bins.values():
+                self._run_bin(requests)
+    
+    def _run_bin(self, requests: list):
+        # Longest prompts first, so each batch holds prompts of similar length
+        requests.sort(key=lambda request: len(request[1]), reverse=True)
+        
+        for start in range(0, len(requests), self.max_size):
+            batch = requests[start:start + self.max_size]
+            try:
+                pipe = get_pipe()
+                results = pipe(
+                    [request[1] for request in batch],
+                    batch_size=len(batch),
+                    pad_token_id=pipe.tokenizer.eos_token_id,
+                    **batch[0][2]
+                )
+            except Exception as e:
+                for request in batch:
+                    request[3].set_exception(e)
+                continue
+            
+            for request, result in zip(batch, results):
+                request[3].set_result(result)
+
+batch_scheduler = BatchScheduler()
+
+@lru_cache(maxsize=1)
+def get_inference_client() -> OpenAI:
+    """Client for the HF_INFERENCE_URL server"""
+    return OpenAI(base_url=HF_INFERENCE_URL, api_key=os.getenv("HF_INFERENCE_API_KEY", "EMPTY"))
+
+def run_pipe(prompt: str, bin_key: str, **kwargs) -> list:
+    """Generate a continuation of prompt with pipeline-style arguments.
+    
+    Uses the HF_INFERENCE_URL server when configured, otherwise the local
+    pipeline (batched with other bin_key requests); either way the result
+    looks like the pipeline's output.
+    """
+    if not HF_INFERENCE_URL:
+        return batch_scheduler.submit(bin_key, prompt, kwargs)
+    
+    # no_repeat_ngram_size has no server-side equivalent and is dropped
+    completion = get_inference_client().completions.create(
+        model=HF_MODEL,
+        prompt=prompt,
+        max_tokens=kwargs.get('max_new_tokens', 100),
+        temperature=kwargs.get('temperature', 1.0) if kwargs.get('do_sample') else 0.0,
+        top_p=kwargs.get('top_p', 1.0),
+        stop=kwargs.get('stop_sequences'),
+        extra_body={'repetition_penalty': kwargs.get('repetition_penalty', 1.0)}
+    )
+    return [{'generated_text': choice.text} for choice in completion.choices]
+
+# Prompt scaffolding per kind of request; the prompt is always tokenized
+# whole, since BPE merges can span the template/prompt boundary
+TEXT_PROMPT_TEMPLATE = "Question: {prompt}\nAnswer:"
+CHAT_PROMPT_TEMPLATE = "Human: {prompt}\nAssistant: I'll help you with that."
+CODE_PROMPT_TEMPLATE = "Write {prompt}:\n\n```python\n"
+
+# get_smart_response code keywords, matched anywhere in the prompt ignoring
+# case with one compiled alternation
+CODE_KEYWORD_PATTERN = re.compile('|'.join(map(re.escape, (
+    'code', 'python', 'function', 'class', 'import', 'def', 'print', 'variable', 'loop', 'if', 'else', 'javascript', 'html', 'css'
+))), re.IGNORECASE)
+
+# Python requests with a fixed answer, returned without running the model when
+# every keyword (including "python", so other languages still reach the model)
+# appears among the prompt's words
+CANNED_CODE_RESPONSES = (
+    (frozenset(("hello", "world", "python")), 'print("Hello, World!")'),
+    (frozenset(("add", "two", "numbers", "python")), 'a = 5\nb = 3\nprint(a + b)')
+)
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+# A leading "A:" answer marker and surrounding newlines, removed in one sub()
+RESPONSE_EDGES_PATTERN = re.compile(r'^(?:A:\s*)?\n*|\n+$')
 
 
 def clean_response(text: str) -> str:
     """Clean up the generated response"""
     # Remove common forum/Q&A artifacts
-    text = re.sub(r'^A:\s*', '', text)
-    text = re.sub(r'^\n+', '', text)
-    text = re.sub(r'\n+$', '', text)
-    
-    # Remove incomplete sentences at the end
-    sentences = text.split('.')
-    if len(sentences) > 1 and sentences[-1].strip() and len(sentences[-1]) < 20:
-        text = '.'.join(sentences[:-1]) + '.'
-    
-    # Remove repetitive patterns
-    lines = text.split('\n')
-    cleaned_lines = []
-    prev_line = ""
+    text = RESPONSE_EDGES_PATTERN.sub('', text)
     
-    for line in lines:
-        line = line.strip()
-        if line and line != prev_line:
-            cleaned_lines.append(line)
-            prev_line = line
+    # Remove incomplete sentences at the end (only the tail is inspected)
+    head, period, tail = text.rpartition('.')
+    if period and tail.strip() and len(tail) < 20:
+        text = head + '.'
     
-    return '\n'.join(cleaned_lines).strip()
+    # Remove blank lines and consecutive repeats
+    lines = filter(None, (line.strip() for line in text.split('\n')))
+    return '\n'.join(line for line, _ in groupby(lines)).strip()
 
 def generate_text(prompt: str) -> str:
     """Generate text using the transformers pipeline"""
@@ -48,15 +195,15 @@ def generate_text(prompt: str) -> str:
     
     try:
         # Format prompt for better conversational response
-        formatted_prompt = f"Question: {prompt}\nAnswer:"
+        formatted_prompt = TEXT_PROMPT_TEMPLATE.format(prompt=prompt)
         
-        result = pipe(
-            formatted_prompt, 
+        result = run_pipe(
+            formatted_prompt,
+            "text",
             max_new_tokens=100,
             temperature=0.7,
             do_sample=True,
             return_full_text=False,
-            pad_token_id=pipe.tokenizer.eos_token_id,
             repetition_penalty=1.1,
             no_repeat_ngram_size=2,
             top_p=0.9
@@ -85,15 +232,15 @@ def generate_chat_response(prompt: str) -> str:
     
     try:
         # Different formatting for chat
-        chat_prompt = f"Human: {prompt}\nAssistant: I'll help you with that."
+        chat_prompt = CHAT_PROMPT_TEMPLATE.format(prompt=prompt)
         
-        result = pipe(
+        result = run_pipe(
             chat_prompt,
+            "chat",
             max_new_tokens=120,
             temperature=0.8,
             do_sample=True,
             return_full_text=False,
-            pad_token_id=pipe.tokenizer.eos_token_id,
             repetition_penalty=1.1,
             no_repeat_ngram_size=2,
             top_p=0.9,
@@ -123,26 +270,82 @@ def generate_chat_response(prompt: str) -> str:
         logger.error(f"Error in chat response: {str(e)}")
         return generate_text(prompt)
 
+def stream_chat_response(prompt: str) -> Iterator[str]:
+    """Generate a conversational response, yielding text as it is produced.
+    
+    Streamed text is passed through as generated, without clean_response().
+    """
+    logger.info(f"Streaming chat response for: {prompt[:50]}...")
+    chat_prompt = CHAT_PROMPT_TEMPLATE.format(prompt=prompt)
+    
+    try:
+        if HF_INFERENCE_URL:
+            stream = get_inference_client().completions.create(
+                model=HF_MODEL,
+                prompt=chat_prompt,
+                max_tokens=120,
+                temperature=0.8,
+                top_p=0.9,
+                stop=["Human:", "Assistant:"],
+                stream=True,
+                extra_body={'repetition_penalty': 1.1}
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].text:
+                    yield chunk.choices[0].text
+            return
+        
+        # Local streams bypass the batch scheduler: generate() feeds the streamer from its own thread
+        pipe = get_pipe()
+        streamer = TextIteratorStreamer(pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = pipe.tokenizer(chat_prompt, return_tensors="pt").to(pipe.model.device)
+        threading.Thread(
+            target=pipe.model.generate,
+            kwargs=dict(
+                **inputs,
+                streamer=streamer,
+                max_new_tokens=120,
+                temperature=0.8,
+                do_sample=True,
+                repetition_penalty=1.1,
+                no_repeat_ngram_size=2,
+                top_p=0.9,
+                pad_token_id=pipe.tokenizer.eos_token_id
+            ),
+            daemon=True
+        ).start()
+        
+        for text in streamer:
+            if text:
+                yield text
+        
+    except Exception as e:
+        logger.error(f"Error in streamed chat response: {str(e)}")
+        yield f"Sorry, I encountered an error: {str(e)}"
+
 def generate_code_response(prompt: str) -> str:
     """Generate code-specific responses with better formatting"""
     logger.info(f"Generating code response for: {prompt[:50]}...")
     
     try:
-        # Much cleaner prompt for code
-        if "hello world" in prompt.lower() and "python" in prompt.lower():
-            # Direct response for hello world
-            return 'print("Hello, World!")'
+        prompt_lower = prompt.lower()
+        
+        # Direct responses for common requests
+        words = set(WORD_PATTERN.findall(prompt_lower))
+        for keywords, canned_response in CANNED_CODE_RESPONSES:
+            if keywords <= words:
+                return canned_response
         
         # General code prompt
-        code_prompt = f'Write {prompt.lower()}:\n\n```python\n'
+        code_prompt = CODE_PROMPT_TEMPLATE.format(prompt=prompt_lower)
         
-        result = pipe(
+        result = run_pipe(
             code_prompt,
+            "code",
             max_new_tokens=80,
             temperature=0.2,  # Very low for clean code
             do_sample=True,
             return_full_text=False,
-            pad_token_id=pipe.tokenizer.eos_token_id,
             repetition_penalty=1.0
         )
         
@@ -170,12 +373,6 @@ def generate_code_response(prompt: str) -> str:
                 logger.info(f"Code response: {final_code}")
                 return final_code
         
-        # Hardcoded responses for common requests
-        if "hello world" in prompt.lower():
-            return 'print("Hello, World!")'
-        elif "add two numbers" in prompt.lower():
-            return 'a = 5\nb = 3\nprint(a + b)'
-        
         return "I'm having trouble generating that code right now."
         
     except Exception as e:
@@ -184,12 +381,8 @@ def generate_code_response(prompt: str) -> str:
 
 def get_smart_response(prompt: str) -> str:
     """Smart router that chooses the best response method"""
-    prompt_lower = prompt.lower()
-    
     # Check if it's a code-related request
-    code_keywords = ['code', 'python', 'function', 'class', 'import', 'def', 'print', 'variable', 'loop', 'if', 'else', 'javascript', 'html', 'css']
-    
-    if any(keyword in prompt_lower for keyword in code_keywords):
+    if CODE_KEYWORD_PATTERN.search(prompt):
         return generate_code_response(prompt)
     else:
         return generate_chat_response(prompt)
\ No newline at end of file
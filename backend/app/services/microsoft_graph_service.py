@@ -1,9 +1,88 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 import msal
 from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from operator import itemgetter
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 import json
+import orjson
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds that the profile and chat/email listings are reused before Graph is asked again
+GRAPH_CACHE_TTL = 30.0
+
+# Microsoft Graph API endpoint
+GRAPH_ENDPOINT = 'https://graph.microsoft.com/v1.0'
+
+# Message fields returned by email listings: everything the AI prompts and
+# the reply/mark-as-read actions use, but not the full HTML body (fetched
+# on demand by get_email_content), which is most of each message's JSON
+EMAIL_LIST_FIELDS = ','.join((
+    'id', 'conversationId', 'subject', 'bodyPreview', 'sender', 'from', 'toRecipients', 'ccRecipients',
+    'receivedDateTime', 'isRead', 'importance', 'hasAttachments', 'webLink'
+))
+
+# Graph paths built on hot paths, with their OData options already URL-encoded
+CHAT_MESSAGES_PATH = 'me/chats/{}/messages?$top={}&$orderby=createdDateTime%20desc'
+CHAT_MESSAGES_SINCE_PATH = 'me/chats/{}/messages?$top={}&$filter=lastModifiedDateTime%20gt%20{}&$orderby=lastModifiedDateTime%20desc'
+FOLDER_MESSAGES_PATH = 'me/mailFolders/{}/messages?$top={}&$orderby=receivedDateTime%20desc&$select=' + EMAIL_LIST_FIELDS
+MESSAGES_SINCE_PATH = 'me/messages?$filter=receivedDateTime%20ge%20{}&$orderby=receivedDateTime%20desc&$select=' + EMAIL_LIST_FIELDS
+SEARCH_MESSAGES_PATH = 'me/messages?$search={}&$top={}&$select=' + EMAIL_LIST_FIELDS
+
+# Keep-alive connections to graph.microsoft.com held open per service, and
+# seconds a Graph request may take to connect or to send each part of its response
+GRAPH_POOL_SIZE = 16
+GRAPH_TIMEOUT = 30
+
+# Graph JSON batching takes at most GRAPH_BATCH_SIZE requests per $batch
+# call; up to GRAPH_MAX_WORKERS batches are sent at once
+GRAPH_BATCH_SIZE = 20
+GRAPH_MAX_WORKERS = 8
+
+# Throttled (429) and unavailable (503/504) GET requests, including single
+# requests inside a $batch, are retried up to GRAPH_MAX_ATTEMPTS times in all,
+# waiting as long as Retry-After says (at most GRAPH_MAX_RETRY_DELAY seconds)
+# or else GRAPH_RETRY_BASE_DELAY seconds, doubling per attempt. Writes (and
+# the $batch POST itself) are only retried when throttled: a 503/504 may come
+# after Graph already acted, and resending would post or send twice
+GRAPH_MAX_ATTEMPTS = 4
+GRAPH_RETRY_BASE_DELAY = 0.5
+GRAPH_MAX_RETRY_DELAY = 30.0
+GRAPH_RETRY_STATUSES = frozenset((429, 503, 504))
+GRAPH_WRITE_RETRY_STATUSES = frozenset((429,))
+
+def graph_retry_statuses(method: str) -> frozenset:
+    """Statuses after which a request with this method is safe to resend"""
+    return GRAPH_RETRY_STATUSES if method == 'GET' else GRAPH_WRITE_RETRY_STATUSES
+
+def graph_retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """Seconds to wait before retry number attempt + 1, preferring the server's Retry-After"""
+    try:
+        return min(float(retry_after), GRAPH_MAX_RETRY_DELAY)
+    except (TypeError, ValueError):
+        return GRAPH_RETRY_BASE_DELAY * 2 ** attempt
+
+@lru_cache(maxsize=None)
+def get_msal_app(client_id: str, client_secret: str, tenant_id: str) -> msal.ConfidentialClientApplication:
+    """Return the shared MSAL client for an app registration"""
+    # Construction fetches the authority's metadata, so it is done once, not per user token
+    return msal.ConfidentialClientApplication(
+        client_id=client_id,
+        client_credential=client_secret,
+        authority=f"https://login.microsoftonline.com/{tenant_id}"
+    )
+
+def email_recipient(address: str) -> Dict:
+    """Graph recipient resource for an email address"""
+    return {"emailAddress": {"address": address}}
 
 class MicrosoftGraphService:
     def __init__(self):
@@ -13,7 +92,8 @@ class MicrosoftGraphService:
         self.redirect_uri = os.getenv('MICROSOFT_REDIRECT_URI')
         
         # Microsoft Graph API endpoints
-        self.graph_endpoint = 'https://graph.microsoft.com/v1.0'
+        self.graph_endpoint = GRAPH_ENDPOINT
+        self._url_prefix = f'{GRAPH_ENDPOINT}/'
         
         # Required scopes for Teams and Outlook
         self.scopes = [
@@ -28,14 +108,22 @@ class MicrosoftGraphService:
             'https://graph.microsoft.com/offline_access'
         ]
         
-        # Initialize MSAL app
-        self.app = msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            client_credential=self.client_secret,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}"
-        )
+        # MSAL app (shared by every service with the same credentials)
+        self.app = get_msal_app(self.client_id, self.client_secret, self.tenant_id)
         
         self.access_token = None
+        # Set for sign-ins through get_token_from_code, whose tokens MSAL can refresh
+        self._account = None
+        
+        # Reuse keep-alive connections to graph.microsoft.com across requests;
+        # the auth header is set on the session once per token
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=GRAPH_POOL_SIZE))
+        self.session.headers['Content-Type'] = 'application/json'
+        
+        # Short-lived cache of listings: name -> (expires_at, value)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
 
     def get_auth_url(self) -> str:
         """Get the authorization URL for OAuth flow"""
@@ -54,7 +142,10 @@ class MicrosoftGraphService:
         )
         
         if "access_token" in result:
-            self.access_token = result["access_token"]
+            username = result.get("id_token_claims", {}).get("preferred_username")
+            accounts = self.app.get_accounts(username=username) if username else []
+            self._account = accounts[0] if accounts else None
+            self.set_access_token(result["access_token"])
             return {"success": True, "token": result}
         else:
             return {"success": False, "error": result.get("error_description", "Unknown error")}
@@ -62,71 +153,182 @@ class MicrosoftGraphService:
     def set_access_token(self, token: str):
         """Set the access token manually"""
         self.access_token = token
+        self.session.headers['Authorization'] = f'Bearer {token}'
+        self.clear_cache()
+
+    def _refresh_access_token(self):
+        """Swap in a renewed token from MSAL's token cache (refreshed there shortly before expiry)"""
+        try:
+            result = self.app.acquire_token_silent(self.scopes, account=self._account)
+        except Exception as e:
+            logger.warning(f"Silent token refresh failed: {str(e)}")
+            return
+        
+        token = (result or {}).get("access_token")
+        if token and token != self.access_token:
+            self.access_token = token
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def clear_cache(self, *names: str):
+        """Drop the named cached results (all of them if none are named) so the next call goes to Graph"""
+        with self._cache_lock:
+            if not names:
+                self._cache.clear()
+            for name in names:
+                self._cache.pop(name, None)
+
+    def _cached(self, name: str, fetch) -> Any:
+        """Return a copy of fetch()'s result, reusing it for GRAPH_CACHE_TTL seconds"""
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(name)
+            if entry and entry[0] > now:
+                return entry[1].copy()
+        
+        value = fetch()
+        # Empty results may be a failed request, so only real results are kept
+        if value and not (isinstance(value, dict) and 'error' in value):
+            with self._cache_lock:
+                self._cache[name] = (now + GRAPH_CACHE_TTL, value)
+        return value.copy()
 
     def _make_graph_request(self, endpoint: str, method: str = 'GET', data: Dict = None) -> Dict:
         """Make a request to Microsoft Graph API"""
+        if self._account:
+            self._refresh_access_token()
         if not self.access_token:
             return {"error": "No access token available"}
 
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        url = f"{self.graph_endpoint}/{endpoint}"
+        url = self._url_prefix + endpoint
+        # Payloads are encoded and decoded with orjson; the session sends the JSON content type
+        payload = orjson.dumps(data) if method != 'GET' else None
+        retry_statuses = graph_retry_statuses(method)
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data)
-            elif method == 'PATCH':
-                response = requests.patch(url, headers=headers, json=data)
+            for attempt in range(GRAPH_MAX_ATTEMPTS):
+                if method == 'GET':
+                    response = self.session.get(url, timeout=GRAPH_TIMEOUT)
+                elif method == 'POST':
+                    response = self.session.post(url, data=payload, timeout=GRAPH_TIMEOUT)
+                elif method == 'PATCH':
+                    response = self.session.patch(url, data=payload, timeout=GRAPH_TIMEOUT)
+                
+                if response.status_code not in retry_statuses or attempt == GRAPH_MAX_ATTEMPTS - 1:
+                    break
+                delay = graph_retry_delay(response.headers.get('Retry-After'), attempt)
+                logger.warning(f"Graph returned {response.status_code} for {endpoint}, retrying in {delay:.2f}s")
+                time.sleep(delay)
             
             response.raise_for_status()
-            return response.json()
+            # Some calls (e.g. sendMail's 202 Accepted) return no body
+            return orjson.loads(response.content) if response.content else {}
         
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             return {"error": str(e)}
 
+    def _batch_graph_request(self, sub_requests: List[Dict]) -> List[Dict]:
+        """Send requests ({"method", "url"[, "body"]}) through $batch and return their bodies in order"""
+        batches = [sub_requests[start:start + GRAPH_BATCH_SIZE] for start in range(0, len(sub_requests), GRAPH_BATCH_SIZE)]
+        if len(batches) <= 1:
+            return [body for batch in batches for body in self._send_batch(batch)]
+        
+        with ThreadPoolExecutor(max_workers=min(GRAPH_MAX_WORKERS, len(batches))) as executor:
+            return [body for bodies in executor.map(self._send_batch, batches) for body in bodies]
+
+    def _send_batch(self, sub_requests: List[Dict]) -> List[Dict]:
+        """POST one $batch of at most GRAPH_BATCH_SIZE requests, resending any that were throttled"""
+        # Each request is resent by the rules for its own method
+        retry_statuses = [graph_retry_statuses(request.get('method', 'GET')) for request in sub_requests]
+        bodies = [{"error": "No response in batch"}] * len(sub_requests)
+        pending = range(len(sub_requests))
+        
+        for attempt in range(GRAPH_MAX_ATTEMPTS):
+            data = {"requests": [dict(sub_requests[index], id=str(index)) for index in pending]}
+            result = self._make_graph_request('$batch', 'POST', data)
+            if 'error' in result:
+                for index in pending:
+                    bodies[index] = result
+                break
+            
+            # Responses can come back in any order; their ids are the request indexes
+            throttled = []
+            delay = 0.0
+            for response in result.get('responses', []):
+                index = int(response['id'])
+                status = response.get('status', 500)
+                if status in retry_statuses[index] and attempt < GRAPH_MAX_ATTEMPTS - 1:
+                    throttled.append(index)
+                    delay = max(delay, graph_retry_delay((response.get('headers') or {}).get('Retry-After'), attempt))
+                    continue
+                
+                body = response.get('body') or {}
+                if status >= 400:
+                    body = {"error": body.get('error', {}).get('message', f"HTTP {status}")}
+                bodies[index] = body
+            
+            if not throttled:
+                break
+            logger.warning(f"{len(throttled)} batched Graph requests throttled, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            pending = throttled
+        
+        return bodies
+
     # Teams-related methods
     def get_my_chats(self) -> List[Dict]:
         """Get user's Teams chats"""
-        result = self._make_graph_request('me/chats')
-        return result.get('value', [])
+        return self._cached('my_chats', lambda: self._make_graph_request('me/chats').get('value', []))
 
-    def get_chat_messages(self, chat_id: str, limit: int = 50) -> List[Dict]:
-        """Get messages from a specific chat"""
-        endpoint = f'me/chats/{chat_id}/messages?$top={limit}&$orderby=createdDateTime desc'
-        result = self._make_graph_request(endpoint)
+    def get_chat_messages(self, chat_id: str, limit: int = 50, since: Optional[str] = None) -> List[Dict]:
+        """Get messages from a specific chat, optionally only those modified after since (ISO 8601)"""
+        result = self._make_graph_request(self._chat_messages_endpoint(chat_id, limit, since))
         return result.get('value', [])
 
+    @staticmethod
+    def _chat_messages_endpoint(chat_id: str, limit: int, since: Optional[str] = None) -> str:
+        """Graph path for a chat's newest messages"""
+        if since:
+            # Chat messages can only be filtered (and then ordered) by lastModifiedDateTime
+            return CHAT_MESSAGES_SINCE_PATH.format(chat_id, limit, since)
+        return CHAT_MESSAGES_PATH.format(chat_id, limit)
+
     def get_todays_teams_messages(self) -> List[Dict]:
         """Get all Teams messages from today"""
-        today = datetime.now().date()
+        return self._cached('todays_teams_messages', self._fetch_todays_teams_messages)
+
+    def _fetch_todays_teams_messages(self) -> List[Dict]:
+        """Fetch today's Teams messages from every chat"""
+        today_start = datetime.now().strftime('%Y-%m-%dT00:00:00Z')
         all_messages = []
         
         chats = self.get_my_chats()
+        if not chats:
+            return all_messages
+        
+        # Messages of every chat touched today, GRAPH_BATCH_SIZE chats per round trip
+        results = self._batch_graph_request([
+            {"method": "GET", "url": '/' + self._chat_messages_endpoint(chat.get('id'), 20, today_start)}
+            for chat in chats
+        ])
         
-        for chat in chats:
+        for chat, result in zip(chats, results):
             chat_id = chat.get('id')
-            messages = self.get_chat_messages(chat_id, 20)  # Get recent messages
+            messages = result.get('value', [])
             
-            # Filter messages from today
-            todays_messages = []
+            # Graph already dropped older messages; skip ones only edited today.
+            # Graph timestamps are UTC ISO 8601 strings, so they compare as text
             for msg in messages:
-                msg_date = datetime.fromisoformat(msg['createdDateTime'].replace('Z', '+00:00')).date()
-                if msg_date == today:
+                if msg['createdDateTime'] >= today_start:
                     msg['chat_info'] = {
                         'chat_id': chat_id,
                         'topic': chat.get('topic', 'No topic'),
                         'chat_type': chat.get('chatType', 'unknown')
                     }
-                    todays_messages.append(msg)
-            
-            all_messages.extend(todays_messages)
+                    all_messages.append(msg)
         
-        return sorted(all_messages, key=lambda x: x['createdDateTime'], reverse=True)
+        # Newest first; ISO 8601 strings sort chronologically
+        all_messages.sort(key=itemgetter('createdDateTime'), reverse=True)
+        return all_messages
 
     def send_teams_message(self, chat_id: str, message: str) -> Dict:
         """Send a message to a Teams chat"""
@@ -138,19 +340,25 @@ class MicrosoftGraphService:
         }
         
         endpoint = f'me/chats/{chat_id}/messages'
-        return self._make_graph_request(endpoint, 'POST', data)
+        result = self._make_graph_request(endpoint, 'POST', data)
+        self.clear_cache('my_chats', 'todays_teams_messages')
+        return result
 
     # Outlook-related methods
     def get_emails(self, folder: str = 'inbox', limit: int = 20) -> List[Dict]:
         """Get emails from specified folder"""
-        endpoint = f'me/mailFolders/{folder}/messages?$top={limit}&$orderby=receivedDateTime desc'
+        endpoint = FOLDER_MESSAGES_PATH.format(quote(folder, safe=''), limit)
         result = self._make_graph_request(endpoint)
         return result.get('value', [])
 
     def get_todays_emails(self) -> List[Dict]:
         """Get emails received today"""
+        return self._cached('todays_emails', self._fetch_todays_emails)
+
+    def _fetch_todays_emails(self) -> List[Dict]:
+        """Fetch today's emails from Graph"""
         today = datetime.now().strftime('%Y-%m-%d')
-        endpoint = f"me/messages?$filter=receivedDateTime ge {today}T00:00:00Z&$orderby=receivedDateTime desc"
+        endpoint = MESSAGES_SINCE_PATH.format(f'{today}T00:00:00Z')
         result = self._make_graph_request(endpoint)
         return result.get('value', [])
 
@@ -162,82 +370,74 @@ class MicrosoftGraphService:
     def send_email(self, to_emails: List[str], subject: str, body: str, 
                    cc_emails: List[str] = None, attachments: List[Dict] = None) -> Dict:
         """Send an email"""
-        
-        recipients = [{"emailAddress": {"address": email}} for email in to_emails]
-        cc_recipients = [{"emailAddress": {"address": email}} for email in (cc_emails or [])]
-        
-        email_data = {
-            "message": {
-                "subject": subject,
-                "body": {
-                    "contentType": "HTML",
-                    "content": body
-                },
-                "toRecipients": recipients,
-                "ccRecipients": cc_recipients if cc_recipients else []
-            }
-        }
+        message = self._build_message(to_emails, subject, body, cc_emails)
         
         # Add attachments if provided
         if attachments:
-            email_data["message"]["attachments"] = attachments
+            message["attachments"] = attachments
+        
+        email_data = {"message": message}
         
         endpoint = 'me/sendMail'
-        return self._make_graph_request(endpoint, 'POST', email_data)
+        result = self._make_graph_request(endpoint, 'POST', email_data)
+        self.clear_cache('todays_emails')
+        return result
 
     def create_draft_email(self, to_emails: List[str], subject: str, body: str,
                           cc_emails: List[str] = None) -> Dict:
         """Create a draft email"""
-        recipients = [{"emailAddress": {"address": email}} for email in to_emails]
-        cc_recipients = [{"emailAddress": {"address": email}} for email in (cc_emails or [])]
+        draft_data = self._build_message(to_emails, subject, body, cc_emails)
         
-        draft_data = {
+        endpoint = 'me/messages'
+        return self._make_graph_request(endpoint, 'POST', draft_data)
+
+    @staticmethod
+    def _build_message(to_emails: List[str], subject: str, body: str, cc_emails: List[str] = None) -> Dict:
+        """Graph message resource with an HTML body, shared by send_email and create_draft_email"""
+        return {
             "subject": subject,
             "body": {
                 "contentType": "HTML",
                 "content": body
             },
-            "toRecipients": recipients,
-            "ccRecipients": cc_recipients if cc_recipients else []
+            "toRecipients": list(map(email_recipient, to_emails)),
+            "ccRecipients": list(map(email_recipient, cc_emails or ()))
         }
-        
-        endpoint = 'me/messages'
-        return self._make_graph_request(endpoint, 'POST', draft_data)
 
     def search_emails(self, query: str, limit: int = 10) -> List[Dict]:
         """Search emails with a query"""
-        endpoint = f"me/messages?$search=\"{query}\"&$top={limit}"
+        # The quoted search term is percent-encoded so &, # or + in it can't break the query string
+        endpoint = SEARCH_MESSAGES_PATH.format(quote(f'"{query}"', safe=''), limit)
         result = self._make_graph_request(endpoint)
         return result.get('value', [])
 
     def get_user_info(self) -> Dict:
         """Get current user information"""
-        return self._make_graph_request('me')
+        return self._cached('me', lambda: self._make_graph_request('me'))
 
     # Utility methods for AI integration
     def summarize_chat_messages(self, messages: List[Dict]) -> str:
         """Format chat messages for AI summarization"""
-        formatted_messages = []
-        
-        for msg in messages:
-            sender = msg.get('from', {}).get('user', {}).get('displayName', 'Unknown')
-            content = msg.get('body', {}).get('content', '')
-            timestamp = msg.get('createdDateTime', '')
-            
-            formatted_messages.append(f"[{timestamp}] {sender}: {content}")
-        
-        return "\n".join(formatted_messages)
+        return "\n".join(
+            f"[{msg.get('createdDateTime', '')}] "
+            f"{msg.get('from', {}).get('user', {}).get('displayName', 'Unknown')}: "
+            f"{msg.get('body', {}).get('content', '')}"
+            for msg in messages
+        )
 
     def format_emails_for_ai(self, emails: List[Dict]) -> str:
         """Format emails for AI processing"""
-        formatted_emails = []
-        
-        for email in emails:
-            sender = email.get('sender', {}).get('emailAddress', {}).get('name', 'Unknown')
-            subject = email.get('subject', 'No subject')
-            received = email.get('receivedDateTime', '')
-            preview = email.get('bodyPreview', '')
-            
-            formatted_emails.append(f"From: {sender}\nSubject: {subject}\nReceived: {received}\nPreview: {preview}\n---")
-        
-        return "\n".join(formatted_emails)
\ No newline at end of file
+        return "\n".join(
+            f"From: {email.get('sender', {}).get('emailAddress', {}).get('name', 'Unknown')}\n"
+            f"Subject: {email.get('subject', 'No subject')}\n"
+            f"Received: {email.get('receivedDateTime', '')}\n"
+            f"Preview: {email.get('bodyPreview', '')}\n---"
+            for email in emails
+        )
+
+@lru_cache(maxsize=256)
+def get_graph_service(access_token: str) -> MicrosoftGraphService:
+    """Return the shared MicrosoftGraphService for an access token"""
+    graph_service = MicrosoftGraphService()
+    graph_service.set_access_token(access_token)
+    return graph_service
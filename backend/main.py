@@ -17,10 +17,14 @@
 # app.include_router(ask.router, prefix="/api")      # Add this line
 # app.include_router(coworker.router, prefix="/api") # Add prefix here too
 
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 import os
+import asyncio
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from dotenv import load_dotenv
 import logging
 
@@ -32,20 +36,24 @@ from app.routes.coworker import router as coworker_router
 # from app.routes.microsoft import router as microsoft_router
 
 # Import the enhanced AI service
-from app.services.enhanced_ai_service import EnhancedAIService
+from app.services.enhanced_ai_service import EnhancedAIService, get_enhanced_ai_service, DAILY_SUMMARY_PROMPT_TEMPLATE
+from app.models.database import get_db_manager
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
+# Configure logging; LOG_LEVEL (e.g. WARNING in production) overrides the
+# level the service modules' basicConfig calls set first
 logging.basicConfig(level=logging.INFO)
+logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Create FastAPI app
 app = FastAPI(
     title="AI Assistant with Microsoft Graph Integration",
     description="Enhanced AI assistant with Microsoft Teams and Outlook integration",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # orjson serialises large chat exports much faster
 )
 
 # Enable CORS
@@ -57,53 +65,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store session data (in production, use Redis or proper session management)
-user_sessions = {}
+# Clients send the Microsoft Graph token on every call as
+# "Authorization: Bearer <token>", so no server-side session store is needed
+async def get_access_token(authorization: Optional[str] = Header(None)) -> Optional[str]:
+    """Get the Microsoft Graph access token from the Authorization: Bearer header"""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+async def read_json(request: Request):
+    """Parse the request body with orjson instead of Starlette's stdlib json"""
+    return orjson.loads(await request.body())
+
+# Endpoints receive their (cached, per-token) EnhancedAIService as a dependency.
+# The dependencies are async only because FastAPI runs plain functions in its
+# threadpool; none of them block
+async def get_ai_service(access_token: Optional[str] = Depends(get_access_token)) -> EnhancedAIService:
+    """The EnhancedAIService for the request's token, if it has one"""
+    return get_enhanced_ai_service(access_token)
+
+async def require_ai_service(access_token: Optional[str] = Depends(get_access_token)) -> EnhancedAIService:
+    """The EnhancedAIService for the request's token, answering 401 without one"""
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
+    return get_enhanced_ai_service(access_token)
 
 # Include routers
 app.include_router(ask_router, prefix="/api", tags=["AI Chat"])
 app.include_router(coworker_router, prefix="/api", tags=["Coworker"])
 # app.include_router(microsoft_router, prefix="/api/microsoft", tags=["Microsoft Graph"])
 
+# Run SQLite housekeeping (PRAGMA optimize / WAL checkpoint) every 6 hours
+DB_MAINTENANCE_INTERVAL = 6 * 60 * 60
+
+async def _db_maintenance_loop():
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        # Holds the DB lock while it runs, so keep it off the event loop
+        await asyncio.to_thread(get_db_manager().maintenance)
+
+@app.on_event("startup")
+async def schedule_db_maintenance():
+    asyncio.create_task(_db_maintenance_loop())
+
+# Threads for the blocking EnhancedAIService/Gemini/Graph calls that endpoints
+# hand off with asyncio.to_thread. They mostly wait on the network, so the pool
+# is larger than asyncio's default of min(32, cpu_count + 4)
+AI_THREAD_POOL_SIZE = int(os.getenv("AI_THREAD_POOL_SIZE", str(min(64, (os.cpu_count() or 1) * 8))))
+
+@app.on_event("startup")
+async def size_thread_pool():
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=AI_THREAD_POOL_SIZE, thread_name_prefix="ai-worker")
+    )
+
 @app.get("/")
 async def home():
     return {"message": "AI Assistant with Microsoft Graph Integration"}
 
 @app.post("/api/chat")
-async def enhanced_chat(request: Request):
+async def enhanced_chat(request: Request, ai_service: EnhancedAIService = Depends(get_ai_service)):
     """Enhanced chat endpoint that can handle Microsoft Graph integration"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         user_message = data.get('message', '')
         
         if not user_message:
             raise HTTPException(status_code=400, detail="Message is required")
         
-        # Get user's access token if available (you'll need to implement session management)
-        # For now, we'll use a simple in-memory store
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        # Initialize enhanced AI service
-        ai_service = EnhancedAIService(access_token)
-        
         # Process the query
-        result = ai_service.process_user_query(user_message)
+        result = await asyncio.to_thread(ai_service.process_user_query, user_message)
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in enhanced_chat: {str(e)}")
+        logger.error("Error in enhanced_chat: %s", e)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/api/auth/status")
-async def auth_status(request: Request):
+async def auth_status(token: Optional[str] = Depends(get_access_token)):
     """Check if user is authenticated with Microsoft"""
-    client_host = request.client.host if request.client else "unknown"
-    token = user_sessions.get(client_host, {}).get('access_token')
-    
     return {
         "authenticated": bool(token),
         "message": "Connected to Microsoft" if token else "Not connected to Microsoft"
@@ -113,68 +157,51 @@ async def auth_status(request: Request):
 async def microsoft_auth(request: Request):
     """Handle Microsoft authentication (store token)"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         access_token = data.get('access_token')
         
         if not access_token:
             raise HTTPException(status_code=400, detail="Access token is required")
         
-        # Store token in session (implement proper session management in production)
-        client_host = request.client.host if request.client else "unknown"
-        if client_host not in user_sessions:
-            user_sessions[client_host] = {}
-        user_sessions[client_host]['access_token'] = access_token
-        
-        return {"message": "Authentication successful", "authenticated": True}
+        # Nothing is stored server-side; the client sends the token back as a bearer header
+        return {
+            "message": "Authentication successful",
+            "authenticated": True,
+            "access_token": access_token,
+            "token_type": "Bearer"
+        }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in microsoft_auth: {str(e)}")
+        logger.error("Error in microsoft_auth: %s", e)
         raise HTTPException(status_code=500, detail="Authentication failed")
 
 @app.post("/api/microsoft/logout")
 async def microsoft_logout(request: Request):
-    """Handle Microsoft logout"""
-    client_host = request.client.host if request.client else "unknown"
-    if client_host in user_sessions:
-        user_sessions[client_host].pop('access_token', None)
-    
+    """Handle Microsoft logout (the client just discards its bearer token)"""
     return {"message": "Logged out successfully", "authenticated": False}
 
 @app.post("/api/microsoft/quick-actions")
-async def microsoft_quick_actions(request: Request):
+async def microsoft_quick_actions(request: Request, ai_service: EnhancedAIService = Depends(require_ai_service)):
     """Handle quick actions for Microsoft Graph integration"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         action = data.get('action')
         
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
-        
-        ai_service = EnhancedAIService(access_token)
-        
         if action == 'get_daily_summary':
-            # Get both Teams and Outlook summary
-            teams_result = ai_service._handle_teams_messages_today("teams messages today")
-            emails_result = ai_service._handle_emails_today("emails today")
+            # Get both Teams and Outlook summary concurrently
+            teams_result, emails_result = await asyncio.gather(
+                asyncio.to_thread(ai_service._handle_teams_messages_today, "teams messages today"),
+                asyncio.to_thread(ai_service._handle_emails_today, "emails today")
+            )
             
-            summary_prompt = f"""
-            Create a daily summary for the user:
+            summary_prompt = DAILY_SUMMARY_PROMPT_TEMPLATE.format(
+                teams=teams_result.get('response', 'No Teams activity'),
+                emails=emails_result.get('response', 'No email activity')
+            )
             
-            Teams Activity:
-            {teams_result.get('response', 'No Teams activity')}
-            
-            Email Activity:
-            {emails_result.get('response', 'No email activity')}
-            
-            Provide a brief, friendly daily overview and ask what they'd like to focus on.
-            """
-            
-            daily_summary = ai_service.ai_service.generate_response(summary_prompt)
+            daily_summary = await asyncio.to_thread(ai_service.ai_service.generate_response, summary_prompt)
             
             return {
                 "type": "daily_summary",
@@ -199,86 +226,65 @@ async def microsoft_quick_actions(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in microsoft_quick_actions: {str(e)}")
+        logger.error("Error in microsoft_quick_actions: %s", e)
         raise HTTPException(status_code=500, detail=f"Quick action failed: {str(e)}")
 
 # Microsoft Graph endpoints (you'll need to convert your microsoft.py to FastAPI format)
 @app.get("/api/microsoft/teams/messages/today")
-async def get_teams_messages_today(request: Request):
+async def get_teams_messages_today(ai_service: EnhancedAIService = Depends(require_ai_service)):
     """Get today's Teams messages"""
     try:
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
-        
-        ai_service = EnhancedAIService(access_token)
-        result = ai_service._handle_teams_messages_today("Get today's Teams messages")
+        result = await asyncio.to_thread(ai_service._handle_teams_messages_today, "Get today's Teams messages")
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting Teams messages: {str(e)}")
+        logger.error("Error getting Teams messages: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get Teams messages: {str(e)}")
 
 @app.post("/api/microsoft/teams/send")
-async def send_teams_message(request: Request):
+async def send_teams_message(request: Request, ai_service: EnhancedAIService = Depends(require_ai_service)):
     """Send a Teams message"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         recipient = data.get('recipient')
         message = data.get('message')
         
         if not recipient or not message:
             raise HTTPException(status_code=400, detail="Recipient and message are required")
         
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
-        
-        ai_service = EnhancedAIService(access_token)
         query = f"Send Teams message to {recipient}: {message}"
-        result = ai_service._handle_teams_send_message(query)
+        result = await asyncio.to_thread(ai_service._handle_teams_send_message, query)
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error sending Teams message: {str(e)}")
+        logger.error("Error sending Teams message: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send Teams message: {str(e)}")
 
 @app.get("/api/microsoft/outlook/emails/today")
-async def get_emails_today(request: Request):
+async def get_emails_today(ai_service: EnhancedAIService = Depends(require_ai_service)):
     """Get today's emails"""
     try:
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
-        
-        ai_service = EnhancedAIService(access_token)
-        result = ai_service._handle_emails_today("Get today's emails")
+        result = await asyncio.to_thread(ai_service._handle_emails_today, "Get today's emails")
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting emails: {str(e)}")
+        logger.error("Error getting emails: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to get emails: {str(e)}")
 
 @app.post("/api/microsoft/outlook/send")
-async def send_email(request: Request):
+async def send_email(request: Request, ai_service: EnhancedAIService = Depends(require_ai_service)):
     """Send an email"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         to_email = data.get('to')
         subject = data.get('subject')
         message = data.get('message')
@@ -287,27 +293,19 @@ async def send_email(request: Request):
         if not to_email or not subject or not message:
             raise HTTPException(status_code=400, detail="To, subject, and message are required")
         
-        client_host = request.client.host if request.client else "unknown"
-        access_token = user_sessions.get(client_host, {}).get('access_token')
-        
-        if not access_token:
-            raise HTTPException(status_code=401, detail="Not authenticated with Microsoft")
-        
-        ai_service = EnhancedAIService(access_token)
-        
         # Build query for AI service
         query = f"Send email to {to_email} with subject '{subject}': {message}"
         if cc:
             query += f" (CC: {cc})"
             
-        result = ai_service._handle_email_send(query)
+        result = await asyncio.to_thread(ai_service._handle_email_send, query)
         
         return result
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
+        logger.error("Error sending email: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
 
 # Error handlers
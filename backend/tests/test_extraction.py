@@ -0,0 +1,82 @@
+import re
+
+import pytest
+
+from app.services.enhanced_ai_service import (
+    EMAIL_INFO_FIELDS,
+    EMAIL_INFO_PATTERN,
+    MESSAGE_INFO_FIELDS,
+    MESSAGE_INFO_PATTERN,
+    scan_fields
+)
+
+# The per-field pattern lists the fused patterns replaced, searched one after
+# another; the fused scan must give the same answers
+OLD_MESSAGE_PATTERNS = (
+    ('content', (
+        r'send\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
+        r'message\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
+        r'tell\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
+        r'say\s+["\']([^"\']+)["\']'
+    )),
+    ('recipient', (
+        r'(?:to|message)\s+([A-Za-z\s]+)(?:\s+that|\s+to|\s+about)',
+        r'(?:send|tell)\s+([A-Za-z\s]+)\s+that'
+    ))
+)
+OLD_EMAIL_PATTERNS = (
+    ('content', (
+        r'email\s+(?:him|her|them)?\s*["\']([^"\']+)["\']',
+        r'send\s+(?:an\s+)?email\s+["\']([^"\']+)["\']',
+        r'compose\s+["\']([^"\']+)["\']'
+    )),
+    ('subject', (
+        r'subject\s+["\']([^"\']+)["\']',
+        r'about\s+["\']([^"\']+)["\']'
+    )),
+    ('recipient', (
+        r'(?:to|email)\s+([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
+        r'(?:to|email)\s+([A-Za-z\s]+)(?:\s+that|\s+to|\s+about)'
+    ))
+)
+
+QUERIES = [
+    "Email John Doe about 'Q3 plan'",
+    "Send email to the team about 'status' by Friday",
+    "email jane about 'x' and also email to bob@y.com",
+    "Send an email 'Running late' to alice@example.com",
+    "Compose 'Quarterly numbers' with subject 'Q3' to finance about it",
+    "Tell Sarah that 'lunch is at noon'",
+    "Send them \"the deck is ready\"",
+    "message Bob 'hi' then say 'see you'",
+    "Message the design team about 'new mockups'"
+]
+
+def old_extract(groups, query):
+    info = {}
+    for field, patterns in groups:
+        for pattern in patterns:
+            match = re.search(pattern, query, re.IGNORECASE)
+            if match:
+                info[field] = match.group(1).strip() if field == 'recipient' else match.group(1)
+                break
+    return info
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_message_extraction_matches_old_patterns(query):
+    assert scan_fields(MESSAGE_INFO_PATTERN, MESSAGE_INFO_FIELDS, query, query.lower()) == old_extract(OLD_MESSAGE_PATTERNS, query)
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_email_extraction_matches_old_patterns(query):
+    assert scan_fields(EMAIL_INFO_PATTERN, EMAIL_INFO_FIELDS, query, query.lower()) == old_extract(OLD_EMAIL_PATTERNS, query)
+
+def test_subject_after_recipient_is_kept():
+    query = "Email John Doe about 'Q3 plan'"
+    assert scan_fields(EMAIL_INFO_PATTERN, EMAIL_INFO_FIELDS, query, query.lower()) == {
+        'recipient': 'John Doe',
+        'subject': 'Q3 plan'
+    }
+
+def test_email_address_beats_earlier_name():
+    query = "email jane about 'x' and also email to bob@y.com"
+    assert scan_fields(EMAIL_INFO_PATTERN, EMAIL_INFO_FIELDS, query, query.lower())['recipient'] == 'bob@y.com'
@@ -0,0 +1,85 @@
+import orjson
+import pytest
+
+from app.services import microsoft_graph_service
+from app.services.microsoft_graph_service import MicrosoftGraphService
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = orjson.dumps(body) if body is not None else b''
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise microsoft_graph_service.requests.exceptions.HTTPError(f"HTTP {self.status_code}")
+
+
+class FakeSession:
+    """Replays canned responses and records every request sent"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = []
+        self.headers = {}
+
+    def _send(self, method, url):
+        self.sent.append((method, url))
+        return self.responses.pop(0)
+
+    def get(self, url, timeout=None):
+        return self._send('GET', url)
+
+    def post(self, url, data=None, timeout=None):
+        return self._send('POST', url)
+
+    def patch(self, url, data=None, timeout=None):
+        return self._send('PATCH', url)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(microsoft_graph_service.time, 'sleep', delays.append)
+    return delays
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(microsoft_graph_service, 'get_msal_app', lambda *args: None)
+    graph_service = MicrosoftGraphService()
+    graph_service.set_access_token('token')
+    return graph_service
+
+def test_post_is_not_resent_after_504(service, sleeps):
+    service.session = FakeSession([FakeResponse(504), FakeResponse(202)])
+    result = service._make_graph_request('me/sendMail', 'POST', {"message": {}})
+    assert 'error' in result
+    assert service.session.sent == [('POST', service.graph_endpoint + '/me/sendMail')]
+    assert sleeps == []
+
+def test_post_is_resent_after_429(service, sleeps):
+    service.session = FakeSession([FakeResponse(429), FakeResponse(202)])
+    assert service._make_graph_request('me/sendMail', 'POST', {"message": {}}) == {}
+    assert len(service.session.sent) == 2
+    assert len(sleeps) == 1
+
+def test_get_is_resent_after_504(service, sleeps):
+    service.session = FakeSession([FakeResponse(504), FakeResponse(200, {"value": []})])
+    assert service._make_graph_request('me/chats') == {"value": []}
+    assert len(service.session.sent) == 2
+    assert len(sleeps) == 1
+
+def test_batch_resends_only_idempotent_sub_requests(service, sleeps):
+    first = {"responses": [
+        {"id": "0", "status": 504},
+        {"id": "1", "status": 504}
+    ]}
+    second = {"responses": [{"id": "0", "status": 200, "body": {"value": [1]}}]}
+    service.session = FakeSession([FakeResponse(200, first), FakeResponse(200, second)])
+    bodies = service._send_batch([
+        {"method": "GET", "url": "/me/chats"},
+        {"method": "POST", "url": "/chats/1/messages", "body": {}}
+    ])
+    assert bodies[0] == {"value": [1]}
+    assert 'error' in bodies[1]
+    assert len(service.session.sent) == 2